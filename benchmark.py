@@ -0,0 +1,539 @@
+"""Offline benchmark for the bot.
+
+Drives simulated Telegram users through run_telegram_bot against local
+stand-ins for the Telegram Bot API, Eventbrite (API and search pages), Groq
+and Google Sheets, and reports throughput, latency and API calls per event.
+
+    python benchmark.py --users 20 --queries 5 --llm-latency 0.3
+
+Settings read by main.py (EVENTBRITE_RATE_LIMIT, SUMMARY_BATCH_SIZE, ...)
+can be overridden through the environment as usual.
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BENCH_TOKEN = "bench-token"
+SUMMARY_CHAT_ID = "-100"
+
+
+# ---------------- FAKE SERVERS ----------------
+class FakeServer:
+    """Local HTTP server; subclasses answer requests in route()."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else {}
+                status, payload = fake.route(method, url.path, params, body)
+                is_html = isinstance(payload, str)
+                data = payload.encode("utf-8") if is_html else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html" if is_html else "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+
+    def count(self, kind: str):
+        with self._calls_lock:
+            self.calls[kind] += 1
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def route(self, method, path, params, body):
+        raise NotImplementedError
+
+
+class FakeTelegram(FakeServer):
+    """getUpdates/sendMessage with Telegram's offset semantics.
+
+    An update counts as handled once the bot polls with an offset past it,
+    which the bot only does after its handler has finished.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._cond = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._handled = {}
+        self.delivered_at = {}
+        self.confirmed_at = {}
+        self.messages = Counter()  # chat_id -> messages sent by the bot
+        self.polling = threading.Event()  # set on the bot's first long poll
+
+    def send_user_message(self, chat_id: int, text: str) -> int:
+        with self._cond:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({"update_id": update_id, "message": {
+                "message_id": update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False},
+            }})
+            self._handled[update_id] = threading.Event()
+            self._cond.notify_all()
+        return update_id
+
+    def wait_handled(self, update_id: int, timeout: float) -> bool:
+        return self._handled[update_id].wait(timeout)
+
+    def _confirm(self, offset: int):
+        now = time.monotonic()
+        while self._updates and self._updates[0]["update_id"] < offset:
+            update_id = self._updates.pop(0)["update_id"]
+            self.confirmed_at[update_id] = now
+            self._handled[update_id].set()
+
+    def route(self, method, path, params, body):
+        name = path.rsplit("/", 1)[-1]
+        self.count(name)
+        if name == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            timeout = float(params.get("timeout") or 0)
+            deadline = time.monotonic() + timeout
+            if timeout:
+                self.polling.set()
+            with self._cond:
+                self._confirm(offset)
+                while not self._updates and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                now = time.monotonic()
+                for update in self._updates:
+                    self.delivered_at.setdefault(update["update_id"], now)
+                return 200, {"ok": True, "result": list(self._updates)}
+        if name == "sendMessage":
+            with self._cond:
+                self.messages[str(body.get("chat_id"))] += 1
+            return 200, {"ok": True, "result": {"message_id": sum(self.messages.values())}}
+        return 200, {"ok": True, "result": True}
+
+
+class FakeEventbrite(FakeServer):
+    """Search pages under /d/ and the /v3 API, with events_per_search events per keyword."""
+
+    _SEARCH_PATH = re.compile(r"^/d/[^/]+/(?P<keyword>[a-z-]+)--events/?$")
+    _API_PATH = re.compile(r"^/v3/(?P<kind>events|venues|organizers)/(?P<id>\d+)/?$")
+    VENUES = 5
+    ORGANIZERS = 5
+
+    def __init__(self, latency: float = 0.0, events_per_search: int = 10):
+        super().__init__(latency)
+        self.events_per_search = events_per_search
+        self._lock = threading.Lock()
+        self._searches = {}  # keyword -> event IDs
+        self._events = {}    # event ID -> (keyword, position)
+
+    def _search_results(self, keyword: str) -> list:
+        with self._lock:
+            if keyword not in self._searches:
+                first = 100000000 + len(self._events)
+                ids = [str(first + i) for i in range(self.events_per_search)]
+                for position, event_id in enumerate(ids):
+                    self._events[event_id] = (keyword, position)
+                self._searches[keyword] = ids
+            return self._searches[keyword]
+
+    def _venue(self, venue_id) -> dict:
+        return {"id": str(venue_id), "name": f"Venue {venue_id}", "latitude": "48.85", "longitude": "2.35",
+                "address": {"localized_address_display": f"{venue_id} Rue de Bench, Paris"}}
+
+    def _organizer(self, organizer_id) -> dict:
+        return {"id": str(organizer_id), "name": f"Organizer {organizer_id}",
+                "description": {"text": "Runs benchmark events."}, "url": f"{self.url}/o/{organizer_id}"}
+
+    def _event(self, event_id: str, expand: str) -> dict:
+        keyword, position = self._events[event_id]
+        venue_id, organizer_id = int(event_id) % self.VENUES + 1, int(event_id) % self.ORGANIZERS + 1
+        event = {
+            "id": event_id,
+            "name": {"text": f"{keyword.title()} meetup #{position + 1}"},
+            "description": {"text": f"An evening of {keyword} with friends. " * 5},
+            "start": {"local": "2030-01-01T19:00:00", "timezone": "Europe/Paris"},
+            "end": {"local": "2030-01-01T21:00:00"},
+            "created": "2029-12-01T10:00:00Z", "changed": "2029-12-02T10:00:00Z",
+            "status": "live", "currency": "EUR", "capacity": 50, "is_free": position % 2 == 0,
+            "online_event": False, "locale": "en_US",
+            "url": f"{self.url}/e/{keyword}-{event_id}",
+            "venue_id": str(venue_id), "organizer_id": str(organizer_id),
+        }
+        if "venue" in expand:
+            event["venue"] = self._venue(venue_id)
+        if "organizer" in expand:
+            event["organizer"] = self._organizer(organizer_id)
+        return event
+
+    def route(self, method, path, params, body):
+        self.delay()
+        match = self._SEARCH_PATH.match(path)
+        if match:
+            self.count("search_page")
+            # A single page of results per search
+            ids = self._search_results(match.group("keyword")) if params.get("page", "1") == "1" else []
+            results = [{"eventbrite_event_id": event_id, "name": self._event(event_id, "")["name"]["text"],
+                        "url": self._event(event_id, "")["url"]}
+                       for event_id in ids]
+            server_data = json.dumps({"search_data": {"events": {"results": results}}})
+            return 200, f"<html><head><script>window.__SERVER_DATA__ = {server_data};</script></head></html>"
+
+        match = self._API_PATH.match(path)
+        if not match:
+            self.count("not_found")
+            return 404, {"error": "NOT_FOUND"}
+        kind, object_id = match.group("kind"), match.group("id")
+        self.count(kind)
+        if kind == "venues":
+            return 200, self._venue(object_id)
+        if kind == "organizers":
+            return 200, self._organizer(object_id)
+        with self._lock:
+            known = object_id in self._events
+        if not known:
+            return 404, {"error": "NOT_FOUND"}
+        return 200, self._event(object_id, params.get("expand", ""))
+
+
+class FakeGroq(FakeServer):
+    """OpenAI-style chat completions at Groq's /openai/v1 path."""
+
+    _KEYWORD = re.compile(r"find ([a-z]+)")
+    _PACKED = re.compile(r"JSON array of (\d+) strings")
+    _TITLE = re.compile(r"Title: (.*)")
+
+    def __init__(self, latency: float, search_url: str):
+        super().__init__(latency)
+        self.search_url = search_url
+
+    def route(self, method, path, params, body):
+        self.delay()
+        messages = body.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        if any(message["role"] == "system" for message in messages):
+            self.count("parse")
+            match = self._KEYWORD.search(prompt.lower())
+            keyword = match.group(1) if match else "events"
+            content = json.dumps({"location": "paris", "country": "france", "keywords": keyword,
+                                  "formatted_url": f"{self.search_url}/d/france--paris/{keyword}--events/"})
+        else:
+            titles = self._TITLE.findall(prompt)
+            packed = self._PACKED.search(prompt)
+            if packed:
+                self.count("summary_batch")
+                content = json.dumps([f"Don't miss {title}!" for title in titles[:int(packed.group(1))]])
+            else:
+                self.count("summary")
+                content = f"Don't miss {titles[0] if titles else 'this event'}!"
+        return 200, {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+
+# ---------------- IN-MEMORY GSPREAD ----------------
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeWorksheet:
+    """The subset of gspread.Worksheet the bot uses, kept in memory."""
+
+    def __init__(self, title: str, calls: Counter, latency: float = 0.0):
+        self.title = title
+        self.rows = []
+        self._calls = calls
+        self._latency = latency
+        self._lock = threading.Lock()
+
+    def _call(self, name: str):
+        with self._lock:
+            self._calls[name] += 1
+        if self._latency:
+            time.sleep(self._latency)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def cell(self, row: int, col: int) -> FakeCell:
+        self._call("cell")
+        with self._lock:
+            values = self.rows[row - 1] if row <= len(self.rows) else []
+            return FakeCell(values[col - 1] if col <= len(values) else None)
+
+    def resize(self, rows: int):
+        self._call("resize")
+        with self._lock:
+            del self.rows[rows:]
+
+    def insert_row(self, values: list, index: int = 1):
+        self._call("insert_row")
+        with self._lock:
+            self.rows.insert(index - 1, list(values))
+
+    def append_rows(self, rows: list, value_input_option: str = None):
+        self._call("append_rows")
+        with self._lock:
+            self.rows.extend(list(row) for row in rows)
+
+    def row_values(self, row: int) -> list:
+        self._call("row_values")
+        with self._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col: int) -> list:
+        self._call("col_values")
+        with self._lock:
+            return [row[col - 1] if col <= len(row) else "" for row in self.rows]
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet: FakeWorksheet):
+        self.sheet1 = worksheet
+
+
+class FakeSheetsClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.worksheets = {}
+
+    def open(self, name: str) -> FakeSpreadsheet:
+        self.calls["open"] += 1
+        if name not in self.worksheets:
+            self.worksheets[name] = FakeWorksheet(name, self.calls, self.latency)
+        return FakeSpreadsheet(self.worksheets[name])
+
+
+# ---------------- SIMULATED USERS ----------------
+def keyword_for(number: int) -> str:
+    # Letters only, so the rule-based parser accepts it
+    letters = ""
+    while True:
+        number, digit = divmod(number, 26)
+        letters = chr(ord("a") + digit) + letters
+        if not number:
+            return "bench" + letters
+
+
+def wait_for_job(job_queue, update_id: int, timeout: float) -> bool:
+    # With the job queue an update is confirmed once enqueued; the query is done when its job is
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = job_queue.get_by_update(update_id)
+        if job and job["status"] in ("done", "failed"):
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def run_user(user: int, args, telegram: FakeTelegram, job_queue, latencies: list, failures: list,
+             lock: threading.Lock):
+    rng = random.Random(args.seed + user)
+    chat_id = 1000 + user
+    for i in range(args.queries):
+        if args.query_pool:
+            number = rng.randrange(args.query_pool)
+        else:
+            number = user * args.queries + i
+        # The rules can't parse a trailing qualifier, so those queries go to the LLM
+        suffix = " with friends" if rng.random() < args.llm_ratio else ""
+        update_id = telegram.send_user_message(chat_id, f"find {keyword_for(number)} events in paris{suffix}")
+        handled = telegram.wait_handled(update_id, args.timeout)
+        if handled and job_queue is not None:
+            handled = wait_for_job(job_queue, update_id, args.timeout)
+        if not handled:
+            with lock:
+                failures.append(update_id)
+            return
+        finished = time.monotonic() if job_queue is not None else telegram.confirmed_at[update_id]
+        with lock:
+            latencies.append(finished - telegram.delivered_at[update_id])
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+# ---------------- RUN ----------------
+def configure_environment(args, telegram, eventbrite, groq, workdir):
+    credentials = {"client_email": "bench@localhost", "type": "service_account"}
+    os.environ.update({
+        "TELEGRAM_TOKEN": BENCH_TOKEN,
+        "TELEGRAM_CHAT_ID": SUMMARY_CHAT_ID,
+        "TELEGRAM_API_URL": telegram.url,
+        "EVENTBRITE_TOKEN": "bench-token",
+        "EVENTBRITE_API_URL": f"{eventbrite.url}/v3",
+        "EVENTBRITE_SEARCH_URL": eventbrite.url,
+        "OPENAI_API_KEY": "bench-key",
+        "MODEL_NAME": "bench-model",
+        "GROQ_BASE_URL": groq.url,
+        "GOOGLE_CREDENTIALS": base64.b64encode(json.dumps(credentials).encode("utf-8")).decode("ascii"),
+        "FILE_NAME1": "bench-events",
+        "FILE_NAME2": "bench-event-details",
+        "TELEGRAM_MODE": "polling",
+        "DEDUP_DB_PATH": os.path.join(workdir, "event_index.db"),
+        "CRAWL_DB_PATH": os.path.join(workdir, "crawler.db"),
+        "CRAWL_INTERVAL_SECONDS": "0",
+        "METRICS_PORT": "0",
+        "NO_PROXY": "127.0.0.1,localhost",
+    })
+    os.environ.pop("JOB_QUEUE_PATH", None)
+    if args.jobs:
+        os.environ["JOB_QUEUE_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ.setdefault("SCRAPE_MODE", "http")
+
+
+def run(args) -> dict:
+    telegram = FakeTelegram()
+    eventbrite = FakeEventbrite(args.eventbrite_latency, args.events_per_search)
+    groq = FakeGroq(args.llm_latency, eventbrite.url)
+    sheets_client = FakeSheetsClient(args.sheets_latency)
+    workdir = tempfile.mkdtemp(prefix="eventbot-bench-")
+    configure_environment(args, telegram, eventbrite, groq, workdir)
+
+    # Imported only now: their settings are read from the environment at import time
+    import sheets
+    import main
+    import metrics
+
+    sheets.register_client(sheets.load_credentials(), sheets_client)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        main.init()
+        if not args.verbose:
+            import logging
+            logging.getLogger().setLevel(logging.WARNING)
+        # Confirmation of a handled update waits for the next poll; keep that short so it
+        # doesn't dominate the measured latency
+        main.POLL_IDLE_SECONDS = args.poll_idle
+        threading.Thread(target=main.run_telegram_bot, name="bot", daemon=True).start()
+        # Messages sent before the bot starts polling are skipped as old
+        if not telegram.polling.wait(args.timeout):
+            raise RuntimeError("the bot never started polling for updates")
+
+        latencies, failures, lock = [], [], threading.Lock()
+        started = time.monotonic()
+        users = [threading.Thread(target=run_user, name=f"user-{user}", daemon=True,
+                                  args=(user, args, telegram, main.job_queue, latencies, failures, lock))
+                 for user in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+
+        main.sheet_writer.flush()
+        sheets.get_sheet_writer(os.environ["FILE_NAME2"], main.creds_dict).flush()
+
+    events = max(0, sheets_client.worksheets[os.environ["FILE_NAME1"]].row_count - 1)
+    per_event = lambda calls: round(calls / events, 2) if events else None
+    return {
+        "users": args.users,
+        "queries": len(latencies),
+        "failed": len(failures),
+        "seconds": round(elapsed, 2),
+        "qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3) if latencies else None,
+        "latency_p95": round(percentile(latencies, 95), 3) if latencies else None,
+        "events": events,
+        "calls_per_event": {
+            "eventbrite": per_event(sum(count for kind, count in eventbrite.calls.items() if kind != "search_page")),
+            "groq": per_event(sum(groq.calls.values())),
+            "sheets": per_event(sheets_client.calls["append_rows"]),
+            "telegram": per_event(telegram.calls["sendMessage"]),
+        },
+        "calls": {
+            "eventbrite": dict(eventbrite.calls),
+            "groq": dict(groq.calls),
+            "sheets": dict(sheets_client.calls),
+            "telegram": dict(telegram.calls),
+        },
+        "stages": metrics.stage_summary(),
+    }
+
+
+def print_report(result: dict):
+    print(f"📊 {result['queries']} queries from {result['users']} users in {result['seconds']}s "
+          f"→ {result['qps']} queries/s ({result['failed']} timed out)")
+    print(f"⏱️ Latency p50 {result['latency_p50']}s, p95 {result['latency_p95']}s")
+    print(f"🗂️ {result['events']} events stored; API calls per event: {result['calls_per_event']}")
+    print(f"📞 Calls: {result['calls']}")
+    width = max([len(stage) for stage in result["stages"]] + [len("Stage")])
+    print(f"{'Stage':<{width}}  calls  errors  mean")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"{stage:<{width}} {stats['calls']:>6} {stats['errors']:>7}  {stats['mean_seconds'] * 1000:.0f}ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--queries", type=int, default=5, help="queries per user, sent one after another")
+    parser.add_argument("--query-pool", type=int, default=0,
+                        help="draw keywords from this many searches so queries repeat (0: all distinct)")
+    parser.add_argument("--llm-ratio", type=float, default=0.5, help="share of queries only the LLM can parse")
+    parser.add_argument("--events-per-search", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per chat completion")
+    parser.add_argument("--eventbrite-latency", type=float, default=0.05, help="seconds per Eventbrite request")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="seconds per Sheets API call")
+    parser.add_argument("--poll-idle", type=float, default=0.05, help="bot's pause between idle polls")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for a single query")
+    parser.add_argument("--jobs", action="store_true", help="run queries through the SQLite job queue")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    sys.stdout.flush()
+    # The bot's threads never return and queued Telegram messages would hold up a normal exit
+    os._exit(1 if result["failed"] else 0)
@@ -0,0 +1,226 @@
+import asyncio
+import inspect
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "connect.facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "nr-data.net",
+    "optimizely.com",
+    "branch.io",
+)
+
+
+def should_block(resource_type: str, url: str) -> bool:
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).hostname or ""
+    return any(host == blocked or host.endswith("." + blocked) for blocked in BLOCKED_HOSTS)
+
+
+class _Remote:
+    """A Playwright object that lives on the pool's thread.
+
+    Method calls run on that thread and block the caller until they are
+    done, so callers use it like the sync API, e.g. page.locator(sel).count().
+    Playwright objects returned are wrapped the same way.
+    """
+
+    def __init__(self, target, pool):
+        self._target = target
+        self._pool = pool
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            return lambda *args, **kwargs: self._pool._call(value, *args, **kwargs)
+        return self._pool._wrap(value)
+
+
+class _Browser:
+    """A launched browser and its context, with the pages leased from it."""
+
+    def __init__(self, browser, context):
+        self.browser = browser
+        self.context = context
+        self.idle_pages = []
+        self.active = 0
+        self.uses = 0
+
+
+class BrowserPool:
+    """One long-lived headless Chromium whose pages are leased out to the scraper.
+
+    Playwright objects can only be used on the thread that created them, so
+    the browser belongs to a dedicated thread running Playwright's event
+    loop, and the page handed to a caller forwards every call there. Pages
+    leased at the same time run concurrently in that loop, so memory is one
+    browser plus up to max_pages tabs, however many threads scrape. After a
+    crash or max_uses leases, new leases go to a fresh browser and the old
+    one is closed once its last page comes back, so a leaking browser is
+    replaced even when queries never stop overlapping. The browser is closed
+    after idle_seconds without a lease.
+    """
+
+    def __init__(self, max_pages: int = 4, max_uses: int = 50, headless: bool = True,
+                 user_agent: str = "Mozilla/5.0 ...", block_resources: bool = True,
+                 idle_seconds: float = 300):
+        self.max_uses = max_uses
+        self.headless = headless
+        self.user_agent = user_agent
+        self.block_resources = block_resources
+        self.idle_seconds = idle_seconds
+        self._semaphore = threading.BoundedSemaphore(max_pages)
+        # Only touched on the loop thread
+        self._playwright = None
+        self._current = None   # _Browser new leases come from
+        self._retiring = []    # replaced browsers with pages still leased out
+        self._last_release = 0.0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def page(self):
+        with self._semaphore:
+            page, browser = self._run(self._acquire())
+            reusable = False
+            try:
+                yield _Remote(page, self)
+                reusable = True
+            finally:
+                # A page left in an unknown state by an error isn't handed to the next query
+                self._run(self._release(page, browser, reusable))
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self._run(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    # ---------------- CALLER SIDE ----------------
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _call(self, func, *args, **kwargs):
+        async def call():
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return self._wrap(self._run(call()))
+
+    def _wrap(self, value):
+        if type(value).__module__.startswith("playwright."):
+            return _Remote(value, self)
+        return value
+
+    # ---------------- LOOP THREAD ----------------
+    async def _acquire(self):
+        current = self._current
+        if current is not None:
+            crashed = not current.browser.is_connected()
+            if crashed or current.uses >= self.max_uses:
+                logging.info(f"Replacing browser after {current.uses} uses (crashed={crashed}, "
+                             f"{current.active} pages still leased)")
+                await self._retire(current)
+        if self._current is None:
+            self._current = await self._launch()
+        browser = self._current
+        browser.uses += 1
+        browser.active += 1
+        while browser.idle_pages:
+            page = browser.idle_pages.pop()
+            if not page.is_closed():
+                return page, browser
+        try:
+            return await browser.context.new_page(), browser
+        except Exception:
+            browser.active -= 1
+            raise
+
+    async def _release(self, page, browser, reusable: bool):
+        browser.active -= 1
+        self._last_release = self._loop.time()
+        if reusable and browser is self._current and not page.is_closed():
+            browser.idle_pages.append(page)
+        else:
+            await self._close_quietly(page)
+        if browser in self._retiring and not browser.active:
+            self._retiring.remove(browser)
+            await self._shutdown(browser)
+        self._loop.call_later(self.idle_seconds, self._close_if_idle)
+
+    def _close_if_idle(self):
+        idle_for = self._loop.time() - self._last_release
+        current = self._current
+        if current is not None and not current.active and idle_for >= self.idle_seconds:
+            logging.info(f"Closing browser after {idle_for:.0f}s idle")
+            self._loop.create_task(self._retire(current))
+
+    async def _retire(self, browser):
+        # New leases get a fresh browser; this one goes once its leased pages are back
+        if browser is self._current:
+            self._current = None
+        if browser.active:
+            self._retiring.append(browser)
+            for page in browser.idle_pages:
+                await self._close_quietly(page)
+            browser.idle_pages = []
+        else:
+            await self._shutdown(browser)
+
+    async def _launch(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        browser = await self._playwright.chromium.launch(headless=self.headless)
+        context = await browser.new_context(user_agent=self.user_agent)
+        if self.block_resources:
+            await context.route("**/*", self._route)
+        return _Browser(browser, context)
+
+    async def _route(self, route):
+        request = route.request
+        if should_block(request.resource_type, request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _close_quietly(self, resource):
+        try:
+            await resource.close()
+        except Exception as e:
+            logging.warning(f"Browser close failed: {e}")
+
+    async def _shutdown(self, browser):
+        for page in browser.idle_pages:
+            await self._close_quietly(page)
+        browser.idle_pages = []
+        await self._close_quietly(browser.context)
+        await self._close_quietly(browser.browser)
+
+    async def _close(self):
+        # Pages still leased out fail from here on
+        browsers = self._retiring + ([self._current] if self._current is not None else [])
+        self._current = None
+        self._retiring = []
+        for browser in browsers:
+            await self._shutdown(browser)
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                logging.warning(f"Playwright stop failed: {e}")
+            self._playwright = None
@@ -0,0 +1,170 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+class SearchStore:
+    """Saved searches, their subscribers, and the last known results for each.
+
+    results maps a search URL to the event IDs it returned. snapshots keeps
+    the enriched details of each event with its Eventbrite `changed` stamp,
+    so a refresh can tell which events have moved since the last crawl.
+    """
+
+    def __init__(self, path: str = "crawler.db"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS searches (
+                url TEXT PRIMARY KEY,
+                saved INTEGER NOT NULL DEFAULT 0,
+                last_crawled REAL
+            );
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INTEGER,
+                url TEXT,
+                PRIMARY KEY (chat_id, url)
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                url TEXT,
+                event_id TEXT,
+                PRIMARY KEY (url, event_id)
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                event_id TEXT PRIMARY KEY,
+                changed TEXT,
+                details TEXT,
+                updated_at REAL
+            );
+        """)
+        self._db.commit()
+
+    def save_search(self, url: str):
+        with self._lock:
+            self._db.execute("INSERT INTO searches (url, saved) VALUES (?, 1) "
+                             "ON CONFLICT (url) DO UPDATE SET saved = 1", (url,))
+            self._db.commit()
+
+    def subscribe(self, chat_id, url: str):
+        self.save_search(url)
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO subscriptions (chat_id, url) VALUES (?, ?)", (chat_id, url))
+            self._db.commit()
+
+    def unsubscribe(self, chat_id, keep=()) -> int:
+        """Drop the chat's subscriptions; searches left without subscribers stop being
+        crawled, except those in `keep`."""
+        with self._lock:
+            urls = [row[0] for row in self._db.execute("SELECT url FROM subscriptions WHERE chat_id = ?", (chat_id,))]
+            self._db.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+            self._db.executemany(
+                "UPDATE searches SET saved = 0 WHERE url = ? "
+                "AND NOT EXISTS (SELECT 1 FROM subscriptions WHERE subscriptions.url = searches.url)",
+                [(url,) for url in urls if url not in keep],
+            )
+            self._db.commit()
+            return len(urls)
+
+    def subscribers(self, url: str) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT chat_id FROM subscriptions WHERE url = ?", (url,))]
+
+    def due_searches(self, interval: float) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url FROM searches WHERE saved = 1 AND (last_crawled IS NULL OR last_crawled < ?) "
+                "ORDER BY last_crawled IS NOT NULL, last_crawled",
+                (time.time() - interval,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def is_fresh(self, url: str, max_age: float) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT last_crawled FROM searches WHERE url = ?", (url,)).fetchone()
+        return bool(row and row[0] and row[0] >= time.time() - max_age)
+
+    def record_results(self, url: str, event_ids):
+        # Replaces the search's result set and marks it as just crawled
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE url = ?", (url,))
+            self._db.executemany("INSERT OR IGNORE INTO results (url, event_id) VALUES (?, ?)",
+                                 [(url, event_id) for event_id in event_ids])
+            self._db.commit()
+        self.mark_crawled(url)
+
+    def mark_crawled(self, url: str):
+        with self._lock:
+            self._db.execute("INSERT INTO searches (url, last_crawled) VALUES (?, ?) "
+                             "ON CONFLICT (url) DO UPDATE SET last_crawled = excluded.last_crawled",
+                             (url, time.time()))
+            self._db.commit()
+
+    def snapshot_changed(self, event_id: str):
+        """The `changed` stamp of the stored snapshot, or None if there is none."""
+        with self._lock:
+            row = self._db.execute("SELECT changed FROM snapshots WHERE event_id = ?", (event_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_snapshot(self, details: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshots (event_id, changed, details, updated_at) VALUES (?, ?, ?, ?)",
+                (details.get("event_id"), details.get("changed"), json.dumps(details), time.time()),
+            )
+            self._db.commit()
+
+    def snapshots(self, event_ids) -> list:
+        event_ids = list(event_ids)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT details FROM snapshots WHERE event_id IN ({','.join('?' * len(event_ids))})",
+                event_ids,
+            ).fetchall() if event_ids else []
+        return [json.loads(row[0]) for row in rows]
+
+    def results(self, url: str) -> list:
+        # Snapshots of every event the search returned on its last crawl
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.details FROM results r JOIN snapshots s ON s.event_id = r.event_id WHERE r.url = ?",
+                (url,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class CrawlScheduler:
+    """Background thread that calls crawl(url) for every saved search that is due."""
+
+    def __init__(self, store: SearchStore, crawl, interval: float, tick: float = 60):
+        self.store = store
+        self.crawl = crawl
+        self.interval = interval
+        self.tick = min(tick, interval)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="crawler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        for url in self.store.due_searches(self.interval):
+            if self._stop.is_set():
+                return
+            try:
+                logging.info(f"Crawling saved search: {url}")
+                self.crawl(url)
+            except Exception as e:
+                logging.exception(f"Crawl of {url} failed: {e}")
+                self.store.mark_crawled(url)  # try again next interval, not next tick
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.tick)
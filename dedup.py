@@ -0,0 +1,179 @@
+import logging
+import sqlite3
+import threading
+import time
+
+
+class EventIndex:
+    """Local index of event IDs already written to the sheet.
+
+    IDs live in a SQLite table so they survive restarts and are mirrored in a
+    set, so duplicate checks never touch the network. reconcile() merges in
+    IDs that reached the sheet some other way. Each entry also records
+    whether its index and details rows have been written, so rows lost in a
+    crash can be written again, whether its summary has been delivered, and
+    who claimed it, so a retried job gets its own claims back instead of
+    skipping them as duplicates.
+    """
+
+    def __init__(self, path: str = "event_index.db"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                event_id TEXT PRIMARY KEY,
+                title TEXT,
+                url TEXT,
+                added_at REAL,
+                written INTEGER NOT NULL DEFAULT 0,
+                details_written INTEGER NOT NULL DEFAULT 0,
+                delivered INTEGER NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                recovering_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(events)")}
+        if "written" not in columns:
+            # Index files created before rows were tracked; treat existing entries as written
+            self._db.execute("ALTER TABLE events ADD COLUMN written INTEGER NOT NULL DEFAULT 1")
+        if "details_written" not in columns:
+            self._db.execute("ALTER TABLE events ADD COLUMN details_written INTEGER NOT NULL DEFAULT 1")
+        if "delivered" not in columns:
+            self._db.execute("ALTER TABLE events ADD COLUMN delivered INTEGER NOT NULL DEFAULT 1")
+        if "claimed_by" not in columns:
+            self._db.execute("ALTER TABLE events ADD COLUMN claimed_by TEXT")
+        if "recovering_at" not in columns:
+            self._db.execute("ALTER TABLE events ADD COLUMN recovering_at REAL")
+        self._db.commit()
+        self._ids = {row[0] for row in self._db.execute("SELECT event_id FROM events")}
+        logging.info(f"Loaded {len(self._ids)} event IDs from {path}")
+
+    def __contains__(self, event_id) -> bool:
+        with self._lock:
+            return event_id in self._ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def add(self, event_id: str, title: str = None, url: str = None, owner: str = None) -> bool:
+        """Record an event. Returns False if it was already known.
+
+        Other processes may share the database, so an ID missing from the set
+        is claimed with INSERT OR IGNORE, which only one of them can win. An
+        event already claimed by the same owner (e.g. an earlier attempt of
+        the same job) is returned as new again.
+        """
+        with self._lock:
+            if event_id not in self._ids:
+                self._ids.add(event_id)
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO events (event_id, title, url, added_at, written, claimed_by) "
+                    "VALUES (?, ?, ?, ?, 0, ?)",
+                    (event_id, title, url, time.time(), owner),
+                )
+                self._db.commit()
+                if cursor.rowcount == 1:
+                    return True
+            if owner is None:
+                return False
+            row = self._db.execute("SELECT claimed_by FROM events WHERE event_id = ?", (event_id,)).fetchone()
+            return bool(row and row[0] == owner)
+
+    def is_written(self, event_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT written FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        return bool(row and row[0])
+
+    def is_details_written(self, event_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT details_written FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        return bool(row and row[0])
+
+    def is_delivered(self, event_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT delivered FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        return bool(row and row[0])
+
+    def mark_written(self, event_ids):
+        with self._lock:
+            self._db.executemany("UPDATE events SET written = 1 WHERE event_id = ?",
+                                 [(event_id,) for event_id in event_ids])
+            self._db.commit()
+
+    def mark_details_written(self, event_ids):
+        with self._lock:
+            self._db.executemany("UPDATE events SET details_written = 1 WHERE event_id = ?",
+                                 [(event_id,) for event_id in event_ids])
+            self._db.commit()
+
+    def mark_delivered(self, event_ids):
+        with self._lock:
+            self._db.executemany("UPDATE events SET delivered = 1 WHERE event_id = ?",
+                                 [(event_id,) for event_id in event_ids])
+            self._db.commit()
+
+    def mark_dropped(self, event_id: str):
+        # Nothing left to write or deliver, e.g. Eventbrite no longer serves the event
+        with self._lock:
+            self._db.execute("UPDATE events SET details_written = 1, delivered = 1 WHERE event_id = ?", (event_id,))
+            self._db.commit()
+
+    def claim_unwritten(self, older_than: float, owner: str) -> list:
+        """Hand `owner` the events claimed more than `older_than` seconds ago whose index
+        or details row never landed.
+
+        The events are marked as recovering in the same UPDATE, so processes that
+        start together don't recover the same rows; a recovery that dies is
+        taken over once it is older_than seconds old.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE events SET claimed_by = ?, recovering_at = ? "
+                "WHERE (written = 0 OR details_written = 0) AND added_at < ? "
+                "AND (recovering_at IS NULL OR recovering_at < ?)",
+                (owner, now, now - older_than, now - older_than),
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT event_id, title, url FROM events WHERE (written = 0 OR details_written = 0) "
+                "AND claimed_by = ? AND recovering_at = ?",
+                (owner, now),
+            ).fetchall()
+        return [{'event_id': event_id, 'title': title, 'url': url} for event_id, title, url in rows]
+
+    def reconcile(self, fetch_ids) -> int:
+        """Merge IDs returned by fetch_ids() (e.g. the sheet's ID column)."""
+        try:
+            remote_ids = {event_id for event_id in fetch_ids() if event_id}
+        except Exception as e:
+            logging.error(f"Failed to reconcile event index: {e}")
+            return 0
+        with self._lock:
+            missing = remote_ids - self._ids
+            if missing:
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO events (event_id, added_at, written, details_written, delivered) "
+                    "VALUES (?, ?, 1, 1, 1)",
+                    [(event_id, now) for event_id in missing],
+                )
+                self._ids |= missing
+            self._db.executemany("UPDATE events SET written = 1 WHERE event_id = ? AND written = 0",
+                                 [(event_id,) for event_id in remote_ids])
+            self._db.commit()
+        if missing:
+            logging.info(f"Reconciled {len(missing)} event IDs from the sheet")
+        return len(missing)
+
+    def start_reconciler(self, fetch_ids, interval: float):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.reconcile(fetch_ids)
+
+        thread = threading.Thread(target=loop, name="event-index-reconciler", daemon=True)
+        thread.start()
+        return thread
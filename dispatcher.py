@@ -0,0 +1,121 @@
+import logging
+import threading
+from collections import deque
+
+# How many update_ids are remembered for spotting redeliveries
+RECENT_IDS = 10000
+
+
+def chat_key(update: dict):
+    message = update.get("message") or update.get("edited_message") or {}
+    return message.get("chat", {}).get("id")
+
+
+class UpdateDispatcher:
+    """Runs Telegram updates on a bounded pool of worker threads.
+
+    Updates from the same chat are handled one at a time in arrival order,
+    updates from different chats run in parallel. submit() blocks once
+    max_pending updates are waiting, which holds the polling loop back.
+    Duplicates are spotted by ID rather than by order, since webhook
+    deliveries from different chats can arrive out of order.
+    """
+
+    def __init__(self, handler, workers: int = 4, max_pending: int = 50):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._chats = {}         # chat id -> deque of updates not started yet
+        self._ready = deque()    # chats with queued updates and none in flight
+        self._busy = set()       # chats with an update currently being handled
+        self._unacked = set()    # update_ids submitted but not finished
+        self._last_seen = None   # highest update_id ever submitted
+        self._recent = deque()   # recently submitted update_ids, oldest first
+        self._recent_ids = set()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"dispatcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, update: dict) -> bool:
+        """Queue an update. Returns False if it was already submitted.
+
+        Raises RuntimeError once the dispatcher is stopping.
+        """
+        update_id = update["update_id"]
+        key = chat_key(update)
+        with self._cond:
+            if update_id in self._recent_ids:
+                return False
+            while len(self._unacked) >= self.max_pending and not self._stopping:
+                self._cond.wait()
+            if self._stopping:
+                raise RuntimeError("dispatcher is stopping")
+            if update_id in self._recent_ids:  # delivered again while we waited
+                return False
+            self._remember(update_id)
+            self._last_seen = update_id if self._last_seen is None else max(self._last_seen, update_id)
+            self._unacked.add(update_id)
+            queue = self._chats.setdefault(key, deque())
+            queue.append(update)
+            if len(queue) == 1 and key not in self._busy:
+                self._ready.append(key)
+                self._cond.notify_all()
+        return True
+
+    def _remember(self, update_id):
+        self._recent.append(update_id)
+        self._recent_ids.add(update_id)
+        if len(self._recent) > RECENT_IDS:
+            self._recent_ids.discard(self._recent.popleft())
+
+    def committed_offset(self, default=None):
+        """Offset to confirm to getUpdates: nothing past the oldest unfinished update."""
+        with self._cond:
+            if self._unacked:
+                return min(self._unacked)
+            if self._last_seen is None:
+                return default
+            return self._last_seen + 1
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._unacked)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopping:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                update = self._chats[key].popleft()
+                self._busy.add(key)
+
+            try:
+                self.handler(update)
+            except Exception as e:
+                logging.exception(f"Update {update.get('update_id')} failed: {e}")
+            finally:
+                with self._cond:
+                    self._busy.discard(key)
+                    self._unacked.discard(update["update_id"])
+                    if self._chats[key]:
+                        self._ready.append(key)
+                    else:
+                        del self._chats[key]
+                    self._cond.notify_all()
@@ -1,37 +1,90 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from requests.adapters import HTTPAdapter
 from telegram import send_to_telegram
-from open_ai import summarize_event
+from open_ai import summarize_events
+from ratelimit import TokenBucket
+from metrics import timed, count, in_context, stage_timer
+
+EVENTBRITE_API = os.getenv("EVENTBRITE_API_URL", "https://www.eventbriteapi.com/v3")
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Keep-alive connections shared by every Eventbrite API call
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
+# Shared by all concurrent batches so the token's limit holds process-wide
+_limiters = {}
+_limiters_lock = threading.Lock()
 
-def get_eventbrite_event_details(event_id: str, token: str) -> dict:
+def _get_limiter(rate_per_second: float, burst: int) -> TokenBucket:
+    with _limiters_lock:
+        if rate_per_second not in _limiters:
+            _limiters[rate_per_second] = TokenBucket(rate_per_second, capacity=burst)
+        return _limiters[rate_per_second]
+
+def _api_get(path: str, token: str, params: dict = None, limiter: TokenBucket = None):
     headers = {
         "Authorization": f"Bearer {token}"
     }
-
-    # --- 1. Event Info ---
-    event_url = f"https://www.eventbriteapi.com/v3/events/{event_id}/"
-    event_res = requests.get(event_url, headers=headers)
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        # Our own token bucket is timed apart from Eventbrite, so a slow API and a busy
+        # limiter can be told apart
+        if limiter:
+            with stage_timer("eventbrite_rate_limit_wait"):
+                limiter.acquire()
+        with stage_timer("eventbrite_request"):
+            res = _session.get(f"{EVENTBRITE_API}{path}", headers=headers, params=params, timeout=30)
+        count("eventbrite_requests_total", status=res.status_code)
+        if res.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+            return res
+        retry_after = float(res.headers.get("Retry-After", 2 ** attempt))
+        logging.warning(f"Eventbrite rate limited, retrying in {retry_after}s")
+        if limiter:
+            limiter.pause(retry_after)
+        else:
+            with stage_timer("eventbrite_rate_limit_wait"):
+                time.sleep(retry_after)
+
+@timed("eventbrite_expanded")
+def get_expanded_event_details(event_id: str, token: str, limiter: TokenBucket = None) -> dict:
+    # Venue and organizer come back inside the event, one request instead of three
+    event_res = _api_get(f"/events/{event_id}/", token, params={"expand": "venue,organizer"}, limiter=limiter)
+    if 400 <= event_res.status_code < 500 and event_res.status_code != 429:
+        # Removed, private or otherwise not ours to read; retrying won't change that
+        logging.warning(f"Dropping event {event_id}: {event_res.status_code} - {event_res.text}")
+        return None
     if not event_res.ok:
         raise Exception(f"Failed to fetch event: {event_res.status_code} - {event_res.text}")
     event = event_res.json()
-
-    # --- 2. Venue Info ---
-    venue_data = {}
-    if event.get("venue_id"):
-        venue_url = f"https://www.eventbriteapi.com/v3/venues/{event['venue_id']}/"
-        venue_res = requests.get(venue_url, headers=headers)
-        if venue_res.ok:
-            venue_data = venue_res.json()
-
-    # --- 3. Organizer Info ---
-    organizer_data = {}
-    if event.get("organizer_id"):
-        organizer_url = f"https://www.eventbriteapi.com/v3/organizers/{event['organizer_id']}/"
-        organizer_res = requests.get(organizer_url, headers=headers)
-        if organizer_res.ok:
-            organizer_data = organizer_res.json()
-
+    return format_event_details(event, event.get("venue") or {}, event.get("organizer") or {})
+
+def fetch_event_details(event_id: str, token: str, rate_per_second: float = 2.0, burst: int = 8) -> dict:
+    # Single expanded fetch under the shared rate limit, for callers with their own concurrency
+    return get_expanded_event_details(event_id, token, _get_limiter(rate_per_second, burst))
+
+def fetch_event_details_batch(event_ids: list, token: str, max_workers: int = 8, rate_per_second: float = 2.0):
+    """Fetch many events concurrently, yielding (event_id, details, error) as each completes.
+
+    details is None, without an error, for events Eventbrite refuses with a 4xx.
+    """
+    limiter = _get_limiter(rate_per_second, burst=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="eventbrite") as pool:
+        futures = {pool.submit(in_context(get_expanded_event_details), event_id, token, limiter): event_id
+                   for event_id in event_ids}
+        for future in as_completed(futures):
+            event_id = futures[future]
+            try:
+                yield event_id, future.result(), None
+            except Exception as e:
+                yield event_id, None, e
+
+def format_event_details(event: dict, venue_data: dict, organizer_data: dict) -> dict:
     map_location = "NA"
     if venue_data.get("latitude") and venue_data.get("latitude"):
         lat = venue_data.get("latitude")
@@ -40,6 +93,7 @@ def get_eventbrite_event_details(event_id: str, token: str) -> dict:
 
     # --- 4. Format and Return Combined Info ---
     details = {
+        "event_id": event.get("id"),
         "title": event.get("name", {}).get("text"),
         #"summary": event.get("summary"),
         "description_text": event.get("description", {}).get("text"),
@@ -74,31 +128,15 @@ def get_eventbrite_event_details(event_id: str, token: str) -> dict:
 
     return details
 
-def insert_into_google_sheet(sheet_name: str, credentials_path: dict, data: dict, bot_token: str, chat_id: str,openai_api_key: str,model):
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    #creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, scope)
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_path, scope)
-    client = gspread.authorize(creds)
-
-    sheet = client.open(sheet_name).sheet1  # Opens the first sheet
-    headers = sheet.row_values(1)
-
-    if not headers:
-        # Set headers if sheet is empty
-        headers = list(data.keys())
-        sheet.append_row(headers)
-
-    row = [data.get(header, "") for header in headers]
-    sheet.append_row(row)
-    print("✅ Data inserted into Google Sheet.")
+def send_event_summaries(events: list, bot_token: str, chat_id: str, openai_api_key: str, model,
+                         max_workers: int = 4, batch_size: int = 1, coalesce: bool = False):
+    # Summaries are generated concurrently and each is queued for sending as soon as it is
+    # ready; with coalesce, summaries waiting on the chat's rate limit go out as one message
+    if openai_api_key:
+        summaries = summarize_events(events, openai_api_key, model, max_workers, batch_size)
+    else:
+        summaries = ((data, data.get("title", "New event added")) for data in events)
 
-    # --- Send to Telegram if token and chat_id are provided ---
-    if bot_token and chat_id:
-        summary = data.get("title", "New event added")
-
-        if openai_api_key:
-            summary = summarize_event(data, openai_api_key,model)
+    for data, summary in summaries:
         summary += f"\n🔗 {data.get('event_url', '')}"
-        send_to_telegram(bot_token, chat_id, summary)
-
-
+        send_to_telegram(bot_token, chat_id, summary, coalesce=coalesce)
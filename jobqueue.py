@@ -0,0 +1,135 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """SQLite-backed queue of search jobs shared by the bot and worker processes.
+
+    A job is claimed with a lease. If its worker dies the lease runs out
+    and another worker picks the job up again, so every job runs at least
+    once and may run more than once. Jobs are keyed on the Telegram
+    update_id, so an update that is delivered twice only creates one job.
+    """
+
+    def __init__(self, path: str = "jobs.db", max_attempts: int = 3, lease_seconds: float = 900):
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        # Autocommit mode; writes that must be atomic use BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                update_id INTEGER UNIQUE,
+                chat_id INTEGER,
+                query TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                lease_expires REAL,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def enqueue(self, update_id, chat_id, query: str):
+        """Add a job. Returns its id, or None if this update already has one."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (update_id, chat_id, query, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (update_id, chat_id, query, QUEUED, now, now),
+            )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, worker: str):
+        """Lease the oldest runnable job to `worker`, or return None."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE (status = ? OR (status = ? AND lease_expires < ?)) "
+                    "AND attempts < ? ORDER BY id LIMIT 1",
+                    (QUEUED, RUNNING, now, self.max_attempts),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, "
+                        "lease_expires = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, worker, now + self.lease_seconds, now, row["id"]),
+                    )
+                # Expired jobs that used up their attempts are not coming back
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = 'lease expired', updated_at = ? "
+                    "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, now, RUNNING, now, self.max_attempts),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job.update(status=RUNNING, worker=worker, attempts=job["attempts"] + 1)
+        return job
+
+    def complete(self, job_id: int, result=None):
+        self._finish(job_id, DONE, result=json.dumps(result) if result is not None else None)
+
+    def fail(self, job_id: int, error: str):
+        # Back to the queue unless it has used up its attempts
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = FAILED if row is None or row["attempts"] >= self.max_attempts else QUEUED
+        self._finish(job_id, status, error=error)
+        if status == FAILED:
+            logging.error(f"Job {job_id} failed for good: {error}")
+
+    def _finish(self, job_id: int, status: str, result: str = None, error: str = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def get(self, job_id: int):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_by_update(self, update_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE update_id = ?", (update_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def get_state(self, key: str, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_state(self, key: str, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
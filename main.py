@@ -1,17 +1,26 @@
+import socket
+import sys
+import threading
 import time
 import logging
-import json
-import base64
 from re import search
 
-from playwright.sync_api import sync_playwright, TimeoutError
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from event_api import get_eventbrite_event_details
-from event_api import insert_into_google_sheet
+from event_api import fetch_event_details, fetch_event_details_batch
+from event_api import send_event_summaries
 from dotenv import load_dotenv
-from open_ai import extract_event_filters_and_generate_url
-from telegram import get_updates, send_message, get_latest_offset
+from open_ai import extract_event_filters_and_generate_url, EVENTBRITE_SEARCH_URL
+from telegram import get_updates, send_message, get_latest_offset, set_webhook, delete_webhook
+from dispatcher import UpdateDispatcher
+from webhook import WebhookServer
+from browser_pool import BrowserPool
+from sheets import load_credentials, get_worksheet, get_sheet_writer
+from scraper import stream_events
+from pipeline import Stage, run_pipeline
+from dedup import EventIndex
+from jobqueue import JobQueue
+from crawler import SearchStore, CrawlScheduler
+from open_ai import query_cache_stats, summary_cache_stats
+from metrics import timed, trace, TraceIdFilter, register_gauges, start_metrics_server
 import os
 
 # Load variables from .env file into environment
@@ -27,24 +36,6 @@ FILE_NAME2 = os.getenv("FILE_NAME2")
 #CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE")
 EVENTBRITE_TOKEN = os.getenv("EVENTBRITE_TOKEN")
 
-# Read Base64 string from environment variable
-creds_b64 = os.getenv("GOOGLE_CREDENTIALS")
-if creds_b64 is None:
-    print("❌ ERROR: GOOGLE_CREDENTIALS not found in environment!")
-    print("Available vars:", list(os.environ.keys()))
-    sys.exit(1)
-else:
-    print("✅ GOOGLE_CREDENTIALS found. Length:", len(creds_b64))
-creds_b64 = creds_b64.strip()
-
-# Fix padding
-missing_padding = len(creds_b64) % 4
-if missing_padding:
-    creds_b64 += '=' * (4 - missing_padding)
-# Decode Base64 back to JSON
-creds_json = base64.b64decode(creds_b64).decode("utf-8")
-creds_dict = json.loads(creds_json)
-
 HELP_MESSAGE = """
 🤖 I can help you find events from Eventbrite.
 
@@ -57,21 +48,10 @@ Example: "Find tech meetups in New York this weekend"
 
 You can also send:
 - "Help" → to see this message again
+- "/subscribe [query]" → get new events for a search as they are published
+- "/unsubscribe" → stop all your subscriptions
 """
 
-# ---------------- GOOGLE SHEETS SETUP ----------------
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-#creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-sheet = client.open(FILE_NAME1).sheet1
-
-
-# Write headers (once)
-if sheet.row_count < 1 or sheet.cell(1, 1).value != "Title":
-    sheet.resize(rows=1)
-    sheet.insert_row(["Title", "URL", "Event ID"], 1)
-
 # ---------------- LOGGING SETUP ----------------
 class WhiteFormatter(logging.Formatter):
     WHITE = '\033[97m'
@@ -81,166 +61,452 @@ class WhiteFormatter(logging.Formatter):
         msg = super().format(record)
         return f"{self.WHITE}{msg}{self.RESET}"
 
-formatter = WhiteFormatter('%(asctime)s - %(levelname)s - %(message)s')
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
+def setup_logging():
+    formatter = WhiteFormatter('%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s')
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    handler.addFilter(TraceIdFilter())
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
 
 # ---------------- CONFIGURATION ----------------
 SEARCH_KEYWORDS = ["wellbeing"]
 LOCATION = "france--paris"
-MAX_SCROLL_ATTEMPTS = 5
+PAGINATION_DEADLINE_SECONDS = float(os.getenv("PAGINATION_DEADLINE_SECONDS", "30"))
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "auto")  # auto, http or browser
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "4"))
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "50"))
+POLL_IDLE_SECONDS = 1
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")  # polling or webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public URL registered with Telegram; unset for local testing
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "4"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "50"))
+BROWSER_IDLE_SECONDS = int(os.getenv("BROWSER_IDLE_SECONDS", "300"))  # close the browser when unused this long
+EVENTBRITE_WORKERS = int(os.getenv("EVENTBRITE_WORKERS", "8"))
+EVENTBRITE_RATE_LIMIT = float(os.getenv("EVENTBRITE_RATE_LIMIT", "2"))  # requests per second
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "1"))  # events packed per LLM request
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))  # items buffered between stages
+TELEGRAM_COALESCE = os.getenv("TELEGRAM_COALESCE", "1") == "1"  # merge queued summaries per chat
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", "event_index.db")
+DEDUP_RECONCILE_SECONDS = int(os.getenv("DEDUP_RECONCILE_SECONDS", "3600"))
+CRAWL_DB_PATH = os.getenv("CRAWL_DB_PATH", "crawler.db")
+CRAWL_INTERVAL_SECONDS = int(os.getenv("CRAWL_INTERVAL_SECONDS", "3600"))  # 0 turns the crawler off
+CRAWL_FRESH_SECONDS = int(os.getenv("CRAWL_FRESH_SECONDS", "7200"))  # serve queries from crawled data this recent
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH")  # set to run queries as durable jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # job worker threads per process
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "900"))
+JOB_POLL_SECONDS = 1
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus /metrics on localhost; 0 turns it off
+
+# Set up by init(), so importing this module doesn't touch credentials, sheets or local stores
+creds_dict = None
+sheet = None
+sheet_writer = None
+details_writer = None
+browser_pool = None
+event_index = None
+crawl_store = None
+job_queue = None
+_init_lock = threading.Lock()
+
+def init():
+    global creds_dict, sheet, sheet_writer, details_writer, browser_pool, event_index, crawl_store, job_queue
+    with _init_lock:
+        if sheet is not None:
+            return
+        setup_logging()
+
+        # Decode the Base64 service account JSON from GOOGLE_CREDENTIALS
+        creds_dict = load_credentials()
+        if creds_dict is None:
+            print("❌ ERROR: GOOGLE_CREDENTIALS not found in environment!")
+            print("Available vars:", list(os.environ.keys()))
+            sys.exit(1)
+        else:
+            print("✅ GOOGLE_CREDENTIALS loaded.")
+
+        # ---------------- GOOGLE SHEETS SETUP ----------------
+        sheet = get_worksheet(FILE_NAME1, creds_dict)
+
+        # Write headers (once)
+        if sheet.row_count < 1 or sheet.cell(1, 1).value != "Title":
+            sheet.resize(rows=1)
+            sheet.insert_row(["Title", "URL", "Event ID"], 1)
+        sheet_writer = get_sheet_writer(FILE_NAME1, creds_dict)
+        details_writer = get_sheet_writer(FILE_NAME2, creds_dict)
+
+        # One browser on its own thread, launched on first use and shared by every scraping thread
+        browser_pool = BrowserPool(max_pages=BROWSER_MAX_PAGES, max_uses=BROWSER_MAX_USES,
+                                   idle_seconds=BROWSER_IDLE_SECONDS)
+        event_index = EventIndex(DEDUP_DB_PATH)
+        # Rows count as written once the Sheets API has them, not when they are buffered
+        sheet_writer.add_flush_listener(lambda rows: event_index.mark_written(row[2] for row in rows))
+        details_writer.add_flush_listener(lambda rows: event_index.mark_details_written(details_row_ids(rows)))
+        crawl_store = SearchStore(CRAWL_DB_PATH)
+        job_queue = JobQueue(JOB_QUEUE_PATH, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS) if JOB_QUEUE_PATH else None
+
+def sheet_event_ids():
+    return sheet.col_values(3)[1:]  # Column C (event_id), skip header
+
+def details_row_ids(rows):
+    headers = details_writer.headers()
+    if "event_id" not in headers:
+        return []
+    column = headers.index("event_id")
+    return [row[column] for row in rows if len(row) > column]
+
+# ---------------- RESULTS PIPELINE ----------------
+def write_index_row(event):
+    # A retried job gets back events its earlier attempt may already have written
+    if event_index.is_written(event['event_id']) or \
+            any(row[2] == event['event_id'] for row in sheet_writer.pending()):
+        return event
+    sheet_writer.append([event['title'], event['url'], event['event_id']])
+    logging.info(f"Queued event for Google Sheet: {event['title']}")
+    return event
+
+def enrich_event(event):
+    data = fetch_event_details(event['event_id'], EVENTBRITE_TOKEN, EVENTBRITE_RATE_LIMIT, EVENTBRITE_WORKERS)
+    if data is None:
+        event_index.mark_dropped(event['event_id'])
+    return data
+
+def write_details_row(data):
+    # As with the index row, skip a details row an earlier attempt already wrote or queued
+    if not event_index.is_details_written(data['event_id']) and \
+            data['event_id'] not in details_row_ids(details_writer.pending()):
+        details_writer.append(data)
+    crawl_store.save_snapshot(data)
+    return data
+
+def deliver_summaries(batch):
+    if isinstance(batch, dict):  # SUMMARY_BATCH_SIZE of 1
+        batch = [batch]
+    batch = [data for data in batch if not event_index.is_delivered(data['event_id'])]
+    # Summarized on this stage worker; the stage's SUMMARY_WORKERS threads are the concurrency
+    send_event_summaries(batch, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, OPENAI_API_KEY, MODEL_NAME,
+                         max_workers=1, batch_size=SUMMARY_BATCH_SIZE, coalesce=TELEGRAM_COALESCE)
+    event_index.mark_delivered(data['event_id'] for data in batch)
+
+def unfinished_events(events, deliver):
+    # A retried job gets back every event it claimed; those an earlier attempt took all the
+    # way through aren't fetched or posted again
+    for event in events:
+        event_id = event['event_id']
+        if event_index.is_written(event_id) and event_index.is_details_written(event_id) and \
+                (not deliver or event_index.is_delivered(event_id)):
+            logging.info(f"Already processed: {event_id}")
+            continue
+        yield event
+
+# Streams events already claimed in event_index through sheet writes, enrichment and
+# Telegram delivery; each stage starts on an event as soon as the previous one is done
+def store_events(events, notify=True):
+    deliver = bool(notify and TELEGRAM_TOKEN and TELEGRAM_CHAT_ID)
+    stages = [
+        Stage("index_sheet", write_index_row),
+        Stage("enrich", enrich_event, workers=EVENTBRITE_WORKERS),
+        Stage("details_sheet", write_details_row),
+    ]
+    if deliver:
+        stages.append(Stage("deliver", deliver_summaries, workers=SUMMARY_WORKERS, batch_size=SUMMARY_BATCH_SIZE))
+    stats = run_pipeline(unfinished_events(events, deliver), stages, PIPELINE_QUEUE_SIZE)
+    if stats["index_sheet"]["processed"]:
+        logging.info(f"Pipeline: {stats}")
+    return stats
+
+def claim_new_events(events, new_event_ids, owner=None):
+    # event_index.add() is atomic across processes; a retried job passes the same owner and
+    # so gets back the events its failed attempt claimed
+    for event in events:
+        if event['url'] != 'N/A' and event_index.add(event['event_id'], event['title'], event['url'], owner):
+            new_event_ids.append(event['event_id'])
+            yield event
+        else:
+            logging.info(f"Duplicate event skipped: {event['event_id']}")
+
+def record_found(events, found):
+    for event in events:
+        if event['url'] != 'N/A':
+            found.append(event)
+        yield event
+
+@timed("scrape_eventbrite")
+def scrape_eventbrite(formatted_url, owner=None):
+    result = {"sources": [], "new_event_ids": [], "errors": 0}
+    for keyword in SEARCH_KEYWORDS:
+        print(f"--- Starting search for keyword: '{keyword}' ---")
+        #formatted_keyword = keyword.replace(" ", "-")
+        #search_url = f"https://www.eventbrite.com/d/{LOCATION}/{formatted_keyword}--events/"
+        search_url = formatted_url
+        report = {}
+        found = []
+        events = stream_events(search_url, browser_pool, PAGINATION_DEADLINE_SECONDS, SCRAPE_MODE, report)
+        stats = store_events(claim_new_events(record_found(events, found), result["new_event_ids"], owner))
+        crawl_store.record_results(search_url, [event['event_id'] for event in found])
+        result["sources"].append(report.get("source"))
+        result["errors"] += sum(stage["errors"] for stage in stats.values())
+        if "deliver" in stats and stats["deliver"]["first_output"] is not None:
+            logging.info(f"First result delivered after {stats['deliver']['first_output']:.1f}s")
+    return result
+
+# Resolves a user's query into a search URL and scrapes it; `owner` identifies a job's
+# event claims so a retry of the job can process them again, and `echo` sends the parsed
+# query back to the user, which a retry has already done
+@timed("query")
+def process_query(chat_id, message, owner=None, echo=True):
+    try:
+        response = extract_event_filters_and_generate_url(message,OPENAI_API_KEY,MODEL_NAME)
+        #print(response)
+        # If response is invalid or missing formatted_url
+        if not response or 'formatted_url' not in response or not response['formatted_url']:
+            send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
+            return None
+        if echo:
+            send_message(chat_id, response,TELEGRAM_TOKEN)
+        formatted_url = response['formatted_url']
+        print(f"<UNK> Received: {formatted_url}")
+    except Exception as e:
+        print(f"⚠️ Parsing error: {e}")
+        send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
+        return None
+
+    # Recently crawled searches skip the scrape; their stored results go through the same
+    # duplicate check and delivery as freshly scraped ones
+    if crawl_store.is_fresh(formatted_url, CRAWL_FRESH_SECONDS):
+        prewarmed = crawl_store.results(formatted_url)
+        if prewarmed:
+            logging.info(f"Serving {len(prewarmed)} pre-warmed events for {formatted_url}")
+            result = {"sources": ["prewarmed"], "new_event_ids": []}
+            events = [{'event_id': data['event_id'], 'title': data.get('title'), 'url': data.get('event_url')}
+                      for data in prewarmed]
+            stats = store_events(claim_new_events(events, result["new_event_ids"], owner))
+            result["errors"] = sum(stage["errors"] for stage in stats.values())
+            return result
+
+    #Start to find the events
+    logging.info("Starting Eventbrite scraper...")
+    return scrape_eventbrite(formatted_url, owner)
+
+# ---------------- SAVED SEARCHES ----------------
+def default_search_urls():
+    return [f"{EVENTBRITE_SEARCH_URL}/d/{LOCATION}/{keyword.replace(' ', '-')}--events/"
+            for keyword in SEARCH_KEYWORDS]
+
+# Re-crawls a saved search: only unseen events go through the full pipeline and, as with
+# a live query, are posted to TELEGRAM_CHAT_ID; known ones are re-read and only count as
+# updated once their `changed` stamp has moved
+@timed("crawl")
+def crawl_search(url):
+    found = []
+    new_event_ids = []
+    events = stream_events(url, browser_pool, PAGINATION_DEADLINE_SECONDS, SCRAPE_MODE)
+    store_events(claim_new_events(record_found(events, found), new_event_ids))
+
+    new_ids = set(new_event_ids)
+    known_ids = [event['event_id'] for event in found if event['event_id'] not in new_ids]
+    updated = []
+    for event_id, data, error in fetch_event_details_batch(known_ids, EVENTBRITE_TOKEN,
+                                                           EVENTBRITE_WORKERS, EVENTBRITE_RATE_LIMIT):
+        if error:
+            logging.warning(f"Refresh of {event_id} failed: {error}")
+            continue
+        if data is None:
+            continue
+        previous = crawl_store.snapshot_changed(event_id)
+        if previous != data.get("changed"):
+            crawl_store.save_snapshot(data)
+            if previous is not None:  # no snapshot yet: this crawl is the baseline
+                updated.append(data)
+    crawl_store.record_results(url, [event['event_id'] for event in found])
+
+    deltas = crawl_store.snapshots(new_event_ids) + updated
+    logging.info(f"Crawled {url}: {len(found)} events, {len(new_event_ids)} new, {len(updated)} updated")
+    if deltas and TELEGRAM_TOKEN:
+        for chat_id in crawl_store.subscribers(url):
+            send_event_summaries(deltas, TELEGRAM_TOKEN, chat_id, OPENAI_API_KEY, MODEL_NAME,
+                                 SUMMARY_WORKERS, SUMMARY_BATCH_SIZE, TELEGRAM_COALESCE)
+
+def handle_subscription(chat_id, message):
+    if message.lower().startswith("/unsubscribe"):
+        removed = crawl_store.unsubscribe(chat_id, keep=default_search_urls())
+        send_message(chat_id, f"🔕 Removed {removed} subscription(s).", TELEGRAM_TOKEN)
+        return
+    query = message[len("/subscribe"):].strip()
+    response = extract_event_filters_and_generate_url(query, OPENAI_API_KEY, MODEL_NAME) if query else None
+    if not response or not response.get('formatted_url'):
+        send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
+        return
+    crawl_store.subscribe(chat_id, response['formatted_url'])
+    send_message(chat_id, f"🔔 Subscribed: {response['formatted_url']}", TELEGRAM_TOKEN)
+
+# Handles a single Telegram update; runs on a dispatcher worker thread
+def handle_update(update):
+    # Log lines for this update, including those from pipeline threads, share its trace ID
+    with trace(f"u{update.get('update_id')}"):
+        _handle_update(update)
+
+def _handle_update(update):
+    message = update.get("message", {}).get("text")
+    chat_id = update.get("message", {}).get("chat", {}).get("id")
+    if not message:
+        return
+
+    print(f"📨 Received: {message}")
+     # If greeting/help keyword
+    if message.lower() in ["help", "/help", "hi", "hello"]:
+        send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
+        return
+
+    if message.lower().startswith(("/subscribe", "/unsubscribe")):
+        handle_subscription(chat_id, message)
+        return
+
+    if job_queue is not None:
+        # Picked up by a job worker in this or another process
+        job_queue.enqueue(update["update_id"], chat_id, message)
+    else:
+        process_query(chat_id, message)
+
+def run_job_worker(worker_name):
+    while True:
+        job = job_queue.claim(worker_name)
+        if job is None:
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+        # Same trace ID as the update that created the job, in whichever process runs it
+        with trace(f"u{job['update_id']}"):
+            logging.info(f"Job {job['id']} claimed by {worker_name} (attempt {job['attempts']})")
+            try:
+                result = process_query(job["chat_id"], job["query"], owner=f"job-{job['id']}",
+                                       echo=job["attempts"] == 1)
+                if result and result.get("errors"):
+                    # Failed events stay claimed by this job; the retry picks them up again
+                    raise RuntimeError(f"{result['errors']} event(s) failed in the pipeline")
+                job_queue.complete(job["id"], result)
+            except Exception as e:
+                logging.exception(f"Job {job['id']} failed: {e}")
+                job_queue.fail(job["id"], str(e))
+
+def start_job_workers(count):
+    threads = []
+    for i in range(count):
+        name = f"{socket.gethostname()}-{os.getpid()}-{i}"
+        thread = threading.Thread(target=run_job_worker, args=(name,), name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+# Events whose index or details row never landed (e.g. the process died before a writer
+# flushed); each is claimed by one process, and rows already written are skipped
+def recover_unwritten_events():
+    owner = f"recovery-{socket.gethostname()}-{os.getpid()}"
+    events = event_index.claim_unwritten(older_than=JOB_LEASE_SECONDS, owner=owner)
+    if events:
+        logging.warning(f"Re-inserting {len(events)} events that never reached the sheet")
+        store_events(events)
+
+def cache_gauges():
+    for name, stats in [("query", query_cache_stats()), ("summary", summary_cache_stats())]:
+        yield "cache_hit_rate", {"cache": name}, stats["hit_rate"]
+        yield "cache_size", {"cache": name}, stats["size"]
+    if job_queue is not None:
+        for status, jobs in job_queue.counts().items():
+            yield "jobs", {"status": status}, jobs
+
+def start_metrics():
+    if METRICS_PORT <= 0:
+        return
+    register_gauges(cache_gauges)
+    try:
+        start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        # e.g. a second worker process on the same host
+        logging.warning(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
+
+def startup():
+    start_metrics()
+    # Known event IDs, synced with the sheet at startup and then periodically
+    event_index.reconcile(sheet_event_ids)
+    event_index.start_reconciler(sheet_event_ids, DEDUP_RECONCILE_SECONDS)
+    recover_unwritten_events()
+
+def start_dispatcher() -> UpdateDispatcher:
+    startup()
+    if CRAWL_INTERVAL_SECONDS > 0:
+        for url in default_search_urls():
+            crawl_store.save_search(url)
+        CrawlScheduler(crawl_store, crawl_search, CRAWL_INTERVAL_SECONDS).start()
+    if job_queue is not None:
+        start_job_workers(JOB_WORKERS)
+    dispatcher = UpdateDispatcher(handle_update, workers=DISPATCH_WORKERS, max_pending=DISPATCH_QUEUE_SIZE)
+    dispatcher.start()
+    return dispatcher
 
 # Running the Telegram Bot
-formatted_url = ""
-
 def run_telegram_bot():
-    offset = get_latest_offset(TELEGRAM_TOKEN)  # skip old messages
+    init()
+    delete_webhook(TELEGRAM_TOKEN)  # getUpdates doesn't work while a webhook is set
+    if job_queue is not None:
+        # Pick up where the last run stopped; queued messages become jobs
+        saved_offset = job_queue.get_state("telegram_offset")
+        offset = int(saved_offset) if saved_offset else None
+    else:
+        offset = get_latest_offset(TELEGRAM_TOKEN)  # skip old messages
     #offset = None
+    dispatcher = start_dispatcher()
     print("🤖 Bot is running...")
 
     while True:
         updates = get_updates(offset,TELEGRAM_TOKEN)
+        submitted = 0
         if "result" in updates:
             for update in updates["result"]:
-                offset = update["update_id"] + 1
-                message = update.get("message", {}).get("text")
-                chat_id = update.get("message", {}).get("chat", {}).get("id")
-
-                if message:
-                    print(f"📨 Received: {message}")
-                     # If greeting/help keyword
-                    if message.lower() in ["help", "/help", "hi", "hello"]:
-                        send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
-                        continue
-                    try:
-                        response = extract_event_filters_and_generate_url(message,OPENAI_API_KEY,MODEL_NAME)
-                        #print(response)
-                        # If response is invalid or missing formatted_url
-                        if not response or 'formatted_url' not in response or not response['formatted_url']:
-                            send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
-                            continue
-                        send_message(chat_id, response,TELEGRAM_TOKEN)
-                        formatted_url = response['formatted_url']
-                        print(f"<UNK> Received: {formatted_url}")
-                    except Exception as e:
-                        print(f"⚠️ Parsing error: {e}")
-                        send_message(chat_id, HELP_MESSAGE, TELEGRAM_TOKEN)
-                        continue
-
-                    #Start to find the events
-                    if formatted_url:
-
-                        def get_existing_event_ids():
-                            try:
-                                col = sheet.col_values(3)  # Column C (event_id), 1-indexed
-                                return set(col[1:])  # Skip header
-                            except Exception as e:
-                                logging.error(f"Failed to get existing event IDs: {e}")
-                                return set()
-
-                        def extract_event_data(card):
-                            event_data = {}
-                            title_element = card.query_selector('[target="_blank"]')
-                            try:
-                                if title_element:
-                                    title = title_element.get_attribute('aria-label')
-                                    if title and title.startswith("View"):
-                                        title = title[4:].strip()
-                                    url = title_element.get_attribute('href')
-                                    event_id = title_element.get_attribute('data-event-id')
-                                    event_data = {
-                                        'title': title,
-                                        'url': url,
-                                        'event_id': event_id
-                                    }
-                                    print(f'✅ Title: {title}')
-                                    print(f'✅ URL: {url}')
-                                    print(f'✅ Event ID: {event_id}')
-                                    time.sleep(1)
-                                else:
-                                    event_data = {'title': 'N/A', 'url': 'N/A', 'event_id': 'N/A'}
-                            except Exception as e:
-                                logging.error(f"Error: {e}")
-                            return event_data
-
-                        def scrape_eventbrite(playwright):
-                            browser = playwright.chromium.launch(headless=True)
-                            context = browser.new_context(user_agent="Mozilla/5.0 ...")
-                            page = context.new_page()
-
-                            for keyword in SEARCH_KEYWORDS:
-                                existing_ids = get_existing_event_ids()
-
-                                print(f"--- Starting search for keyword: '{keyword}' ---")
-                                #formatted_keyword = keyword.replace(" ", "-")
-                                #search_url = f"https://www.eventbrite.com/d/{LOCATION}/{formatted_keyword}--events/"
-                                search_url = formatted_url
-                                try:
-                                    logging.info(f"Navigating to: {search_url}")
-                                    page.goto(search_url, wait_until="domcontentloaded", timeout=90000)
-                                    page.wait_for_selector('header[class="search-header"]', timeout=60000)
-                                    logging.info("Event list container loaded.")
-                                except TimeoutError:
-                                    logging.warning(f"Timeout for '{keyword}', skipping.")
-                                    continue
-
-                                # Scroll and load more
-                                for i in range(MAX_SCROLL_ATTEMPTS):
-                                    try:
-                                        logging.info(f"Scrolling attempt {i + 1}")
-                                        page.keyboard.press("End")
-                                        time.sleep(3)
-                                        show_more = page.query_selector('button[data-testid="load-more-events-button"]')
-                                        if show_more and show_more.is_visible():
-                                            show_more.click()
-                                            time.sleep(5)
-                                        else:
-                                            break
-                                    except Exception as e:
-                                        logging.warning(f"Scroll error: {e}")
-                                        break
-
-                                event_cards = page.query_selector_all(
-                                    'li > div[class*="SearchResultPanelContentEventCardList"]')
-                                print(f"Total visible events: {len(event_cards)}")
-
-                                for card in event_cards:
-                                    try:
-                                        event = extract_event_data(card)
-                                        if event['url'] != 'N/A' and event['event_id'] not in existing_ids:
-                                            sheet.append_row([event['title'], event['url'], event['event_id']])
-                                            logging.info(f"Inserted event into Google Sheet: {event['title']}")
-                                            existing_ids.add(event['event_id'])  # update in memory
-                                            event_id = event['event_id']
-                                            try:
-                                                data = get_eventbrite_event_details(event_id, EVENTBRITE_TOKEN)
-                                                insert_into_google_sheet(FILE_NAME2, creds_dict, data,
-                                                                         TELEGRAM_TOKEN, TELEGRAM_CHAT_ID,
-                                                                         OPENAI_API_KEY, MODEL_NAME)
-                                                '''
-                                                for k, v in data.items():
-                                                    print(f"{k}: {v}\n")
-                                                '''
-                                            except Exception as e:
-                                                print("❌ Error:", str(e))
-                                        else:
-                                            logging.info(f"Duplicate event skipped: {event['event_id']}")
-                                    except Exception as e:
-                                        logging.error(f"Extraction error: {e}")
-
-                            context.close()
-                            browser.close()
-
-                        logging.info("Starting Eventbrite scraper...")
-                        with sync_playwright() as playwright:
-                            scrape_eventbrite(playwright)
-
-                    time.sleep(1)
+                # Blocks while the dispatcher queue is full
+                if dispatcher.submit(update):
+                    submitted += 1
+        # Only confirm updates whose handling has finished. With JOB_QUEUE_PATH set the
+        # offset is saved and unfinished updates are delivered again after a restart;
+        # without it a restart starts from get_latest_offset and drops the backlog
+        offset = dispatcher.committed_offset(default=offset)
+        if job_queue is not None and offset is not None:
+            job_queue.set_state("telegram_offset", offset)
+        if not submitted:
+            # getUpdates returns in-flight updates straight away instead of long polling
+            time.sleep(POLL_IDLE_SECONDS)
+
+# Receiving updates over a webhook; several replicas can run behind a load balancer
+def run_webhook_server():
+    init()
+    dispatcher = start_dispatcher()
+    server = WebhookServer(dispatcher.submit, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    if WEBHOOK_URL:
+        print(f"🔗 setWebhook: {set_webhook(TELEGRAM_TOKEN, WEBHOOK_URL, WEBHOOK_SECRET)}")
+    print("🤖 Bot is running (webhook)...")
+    server.serve_forever()
+
+# Standalone job worker: `python main.py worker`, run as many as there are cores to spare
+def run_worker_process():
+    init()
+    if job_queue is None:
+        print("❌ ERROR: JOB_QUEUE_PATH must be set to run a worker")
+        sys.exit(1)
+    startup()
+    print(f"🛠️ Worker running with {JOB_WORKERS} threads...")
+    for thread in start_job_workers(JOB_WORKERS):
+        thread.join()
 
 if __name__ == "__main__":
-    run_telegram_bot()
-   
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        run_worker_process()
+    elif TELEGRAM_MODE == "webhook":
+        run_webhook_server()
+    else:
+        run_telegram_bot()
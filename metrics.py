@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "eventbot"
+# Seconds; spans in-memory cache hits up to multi-minute scrapes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_gauge_sources = []
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+def register_gauges(source):
+    """source() returns (name, labels, value) tuples, read on every scrape of /metrics."""
+    _gauge_sources.append(source)
+
+
+def record_stage(stage: str, seconds: float, error: bool = False):
+    observe("stage_duration_seconds", seconds, stage=stage)
+    count("stage_calls_total", stage=stage, status="error" if error else "ok")
+    logging.debug(f"{stage} took {seconds * 1000:.0f}ms{' (error)' if error else ''}")
+
+
+def stage_summary() -> dict:
+    """{stage: {"calls", "errors", "mean_seconds"}} for every stage recorded so far."""
+    with _lock:
+        summary = {}
+        for (name, labels), values in _histograms.items():
+            if name == "stage_duration_seconds":
+                calls = values[-2]
+                summary[dict(labels)["stage"]] = {"calls": calls, "errors": 0,
+                                                  "mean_seconds": values[-1] / calls if calls else 0.0}
+        for (name, labels), value in _counters.items():
+            labels = dict(labels)
+            if name == "stage_calls_total" and labels["status"] == "error" and labels["stage"] in summary:
+                summary[labels["stage"]]["errors"] = value
+    return summary
+
+
+def timed(stage: str, is_error=None):
+    """Record the duration and outcome of each call under `stage`.
+
+    A raised exception counts as an error; so does a return value for which
+    is_error(result) is true, for functions that report failures in-band.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                record_stage(stage, time.perf_counter() - started, error=True)
+                raise
+            error = bool(is_error and is_error(result))
+            record_stage(stage, time.perf_counter() - started, error=error)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_stage(stage, time.perf_counter() - started, error=True)
+        raise
+    record_stage(stage, time.perf_counter() - started)
+
+
+# ---------------- TRACE IDS ----------------
+@contextmanager
+def trace(trace_id: str = None):
+    """Tag log lines emitted inside the block (and in threads started via in_context) with a trace ID."""
+    token = _trace_id.set(trace_id or uuid.uuid4().hex[:12])
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+def current_trace() -> str:
+    return _trace_id.get()
+
+
+def in_context(func):
+    # Run func, on whatever thread calls it, with the caller's trace ID
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+# ---------------- PROMETHEUS ENDPOINT ----------------
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}_{name} histogram")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, bucket_count in zip(BUCKETS, values):
+                lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {values[-1]}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {values[-2]}")
+
+    gauges = {}
+    for source in _gauge_sources:
+        try:
+            for name, labels, value in source():
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        except Exception as e:
+            logging.warning(f"Metrics gauge source failed: {e}")
+    for name, samples in sorted(gauges.items()):
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,8 +1,148 @@
 import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
 from groq import Groq
+from cache import TTLCache
+from metrics import timed, in_context
+
+# Search pages; the LLM's base URL comes from GROQ_BASE_URL, read by the Groq client itself
+EVENTBRITE_SEARCH_URL = os.getenv("EVENTBRITE_SEARCH_URL", "https://www.eventbrite.com")
+
+# Parsed queries, keyed on the day as well since relative dates move
+_query_cache = TTLCache(maxsize=512, ttl=6 * 3600)
+_rule_hits = 0
+_stats_lock = threading.Lock()
+
+# One Groq client per API key, reused so its HTTP connections stay open
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(openai_api_key: str) -> Groq:
+    with _clients_lock:
+        if openai_api_key not in _clients:
+            _clients[openai_api_key] = Groq(api_key=openai_api_key)
+        return _clients[openai_api_key]
+
+DATE_PHRASES = {
+    "today": "today",
+    "tomorrow": "tomorrow",
+    "this weekend": "this-weekend",
+    "this week": "this-week",
+    "next week": "next-week",
+    "this month": "this-month",
+    "next month": "next-month",
+}
+# city -> (Eventbrite country/region slug, city slug)
+KNOWN_CITIES = {
+    "paris": ("france", "paris"),
+    "lyon": ("france", "lyon"),
+    "marseille": ("france", "marseille"),
+    "london": ("united-kingdom", "london"),
+    "berlin": ("germany", "berlin"),
+    "new york": ("ny", "new-york"),
+}
+_LEADING_WORDS = re.compile(r"^(?:please\s+)?(?:find(?: me)?|show(?: me)?|search(?: for)?|look(?:ing)? for|any)\s+")
+_TRAILING_WORDS = re.compile(r"\s+(?:events?|activities)$")
+_KEYWORDS = re.compile(r"^[a-z]+(?: [a-z]+){0,2}$")
+# Nothing but these left after the city and date: no keywords, so Eventbrite's all-events listing
+_ALL_EVENTS_WORDS = {"event", "events", "activities"}
+# Qualifiers the URL can't express; leave those queries to the LLM
+_QUALIFIERS = {"for", "with", "near", "and", "or", "under", "at", "on", "not", "without", "from", "between"}
+# Date and time words outside DATE_PHRASES; left in the keywords they would end up in the URL slug
+_TIME_WORDS = {
+    "today", "tonight", "tomorrow", "yesterday", "now", "soon", "upcoming", "later",
+    "morning", "afternoon", "evening", "night", "noon", "midnight", "am", "pm",
+    "day", "days", "week", "weeks", "weekend", "weekends", "weekday", "weekdays",
+    "month", "months", "year", "years", "this", "next", "last", "coming",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "mondays", "tuesdays", "wednesdays", "thursdays", "fridays", "saturdays", "sundays",
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+}
+
+def normalize_query(prompt_text: str) -> str:
+    text = re.sub(r"\s+", " ", prompt_text.lower()).strip()
+    return text.strip(" .!?")
+
+def parse_query_rules(prompt_text: str):
+    """Handle simple "<keywords> [events] <date> in <city>" queries without the LLM."""
+    text = normalize_query(prompt_text)
+    text = _LEADING_WORDS.sub("", text)
+
+    date_value = None
+    for phrase, value in DATE_PHRASES.items():
+        match = re.search(rf"\b{phrase}\b", text)
+        if match:
+            date_value = value
+            text = (text[:match.start()] + text[match.end():]).strip()
+            text = re.sub(r"\s+", " ", text)
+            break
+
+    match = re.search(r"\s+in (?P<city>[a-z ]+)$", text)
+    if not match or match.group("city") not in KNOWN_CITIES:
+        return None
+    country, city = KNOWN_CITIES[match.group("city")]
+    text = text[:match.start()]
+
+    price = None
+    if text.startswith("free "):
+        price = "free"
+        text = text[len("free "):]
+    text = _TRAILING_WORDS.sub("", text)
+    if text in _ALL_EVENTS_WORDS:
+        keywords, slug = "all", "all-events"
+    else:
+        words = set(text.split())
+        if not _KEYWORDS.match(text) or _QUALIFIERS & words or _TIME_WORDS & words:
+            return None
+        keywords = text.replace(" ", "-")
+        slug = f"{keywords}--events"
+
+    params = [f"{name}={value}" for name, value in (("price", price), ("date", date_value)) if value]
+    formatted_url = f"{EVENTBRITE_SEARCH_URL}/d/{country}--{city}/{slug}/"
+    if params:
+        formatted_url += "?" + "&".join(params)
+    result = {"location": city, "country": country, "keywords": keywords}
+    if date_value:
+        result["date"] = date_value
+    if price:
+        result["price"] = price
+    result["formatted_url"] = formatted_url
+    return result
+
+def query_cache_stats() -> dict:
+    stats = _query_cache.stats()
+    with _stats_lock:
+        stats["rule_hits"] = _rule_hits
+    return stats
 
 #extracting event query details and generating the formatted url
+@timed("parse_query", is_error=lambda result: "error" in result)
 def extract_event_filters_and_generate_url(prompt_text: str, openai_api_key: str, model: str):
+    global _rule_hits
+    key = f"{date.today().isoformat()}|{normalize_query(prompt_text)}"
+    cached = _query_cache.get(key)
+    if cached is not None:
+        print(f"⚡ Query cache hit ({query_cache_stats()})")
+        return dict(cached)
+
+    result = parse_query_rules(prompt_text)
+    if result:
+        with _stats_lock:
+            _rule_hits += 1
+    else:
+        result = _generate_url_with_llm(prompt_text, openai_api_key, model)
+    if "error" not in result:
+        _query_cache.set(key, dict(result))
+    return result
+
+@timed("llm_parse", is_error=lambda result: "error" in result)
+def _generate_url_with_llm(prompt_text: str, openai_api_key: str, model: str):
     system_prompt = """
 You are a helpful assistant. Convert a user's natural language event query into a formatted Eventbrite URL. 
 If the month and year are not mentioned in the prompt, assume the next upcoming ones. 
@@ -22,7 +162,7 @@ Only respond with a valid JSON object.
 """
 
     try:
-        client = Groq(api_key=openai_api_key)
+        client = get_client(openai_api_key)
         response = client.chat.completions.create(
             model=model,
             messages=[
@@ -56,35 +196,127 @@ Only respond with a valid JSON object.
         return {"error": str(e)}
 
 #summerizing the details of events
-def summarize_event(event_data: dict, openai_api_key: str, model:str) -> str:
-    # openai.api_key = openai_api_key
+SUMMARY_MAX_WORDS = 120
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_ERROR = "Summary not available due to an error."
 
-    prompt = f"""
-                You are an assistant helping users quickly understand event listings.
+# Summaries only change when the event does, so key on its `changed` timestamp
+_summary_cache = TTLCache(maxsize=2048, ttl=7 * 24 * 3600)
 
-                Summarize the following event details into a friendly, A description suitable for sending over Telegram. Include the title, date, location (if any), and organizer name, Here is a event url from the event url read the 'About thi event' section. Keep it under 5000 words.
+def _summary_key(event_data: dict) -> str:
+    event_id = event_data.get("event_id") or event_data.get("event_url")
+    return f"{event_id}|{event_data.get('changed')}"
 
-                Event data:
-                Title: {event_data.get("title")}
-                URL: {event_data.get("url")}
+def _event_details_text(event_data: dict) -> str:
+    return f"""Title: {event_data.get("title")}
+                URL: {event_data.get("event_url") or event_data.get("url")}
                 Start Time: {event_data.get("start_local")}
                 Location: {event_data.get("venue_address") or "Online"}
                 Organizer: {event_data.get("organizer_name")}
-                Description: {event_data.get("description_text")}
+                Description: {event_data.get("description_text")}"""
+
+@timed("llm_summary", is_error=lambda summary: summary == SUMMARY_ERROR)
+def _summarize_uncached(event_data: dict, openai_api_key: str, model:str) -> str:
+    # openai.api_key = openai_api_key
+    prompt = f"""
+                You are an assistant helping users quickly understand event listings.
+
+                Summarize the following event details into a friendly, A description suitable for sending over Telegram. Include the title, date, location (if any), and organizer name, and what the event is about from its description. Keep it under {SUMMARY_MAX_WORDS} words.
+
+                Event data:
+                {_event_details_text(event_data)}
                     """
 
     try:
         # client = openai.OpenAI(api_key=openai_api_key)
-        client = Groq(api_key=openai_api_key)
+        client = get_client(openai_api_key)
         response = client.chat.completions.create(
             # model="gpt-4o",
             model=model,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+            temperature=0.7,
+            max_tokens=SUMMARY_MAX_TOKENS
         )
         gpt_summary = response.choices[0].message.content.strip()
         print(f'Chat GPT Summary: {gpt_summary}')
+        _summary_cache.set(_summary_key(event_data), gpt_summary)
         return gpt_summary
     except Exception as e:
         print(f"❌ OpenAI Error: {e}")
-        return "Summary not available due to an error."
\ No newline at end of file
+        return SUMMARY_ERROR
+
+def _summarize_single(event_data: dict, openai_api_key: str, model: str) -> list:
+    return [_summarize_uncached(event_data, openai_api_key, model)]
+
+@timed("llm_summary_batch")
+def _summarize_packed(events: list, openai_api_key: str, model: str) -> list:
+    # Several events in one request; falls back to one request each if the reply doesn't parse
+    details = "\n\n".join(f"Event {i + 1}:\n                {_event_details_text(event)}"
+                           for i, event in enumerate(events))
+    prompt = f"""
+                You are an assistant helping users quickly understand event listings.
+
+                Summarize each of the following {len(events)} events into a friendly description suitable for sending over Telegram. Include the title, date, location (if any), and organizer name, and what the event is about from its description. Keep each summary under {SUMMARY_MAX_WORDS} words.
+                Only respond with a JSON array of {len(events)} strings, one summary per event, in the same order.
+
+                {details}
+                    """
+    try:
+        client = get_client(openai_api_key)
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=SUMMARY_MAX_TOKENS * len(events)
+        )
+        summaries = json.loads(response.choices[0].message.content.strip())
+        if not isinstance(summaries, list) or len(summaries) != len(events):
+            raise ValueError(f"expected {len(events)} summaries")
+    except Exception as e:
+        print(f"⚠️ Packed summary failed ({e}), summarizing one by one")
+        return [_summarize_uncached(event, openai_api_key, model) for event in events]
+
+    summaries = [str(summary).strip() for summary in summaries]
+    for event, summary in zip(events, summaries):
+        _summary_cache.set(_summary_key(event), summary)
+    return summaries
+
+def _summarize_batch(batch: list, openai_api_key: str, model: str) -> list:
+    try:
+        if len(batch) == 1:
+            return _summarize_single(batch[0], openai_api_key, model)
+        return _summarize_packed(batch, openai_api_key, model)
+    except Exception as e:
+        print(f"❌ OpenAI Error: {e}")
+        return [SUMMARY_ERROR] * len(batch)
+
+def summarize_events(events: list, openai_api_key: str, model: str, max_workers: int = 4, batch_size: int = 1):
+    """Summarize events concurrently, yielding (event, summary) as each finishes.
+
+    Cached summaries are yielded first. With batch_size > 1, that many events
+    share a single request. With max_workers of 1 the requests run one after
+    another on the calling thread, for callers that bring their own threads.
+    """
+    pending = []
+    for event in events:
+        cached = _summary_cache.get(_summary_key(event))
+        if cached is not None:
+            yield event, cached
+        else:
+            pending.append(event)
+    if not pending:
+        return
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    if max_workers <= 1:
+        for batch in batches:
+            yield from zip(batch, _summarize_batch(batch, openai_api_key, model))
+        return
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarize") as pool:
+        futures = {pool.submit(in_context(_summarize_batch), batch, openai_api_key, model): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            yield from zip(futures[future], future.result())
+
+def summary_cache_stats() -> dict:
+    return _summary_cache.stats()
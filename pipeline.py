@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+import time
+
+from metrics import in_context
+
+_DONE = object()
+
+
+class Stage:
+    """One step of a pipeline, run by `workers` threads.
+
+    func receives a single item, or a list of up to batch_size items that
+    were already waiting, and returns what to pass downstream: an item (or
+    a list of items when batching), or None to drop it.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, batch_size: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processed = 0
+        self.errors = 0
+        self.first_output = None  # seconds from pipeline start to the first item done
+
+
+def _take_batch(inbox: queue.Queue, first, batch_size: int):
+    # Grab whatever else is already waiting, without waiting for more
+    batch = [first]
+    while len(batch) < batch_size:
+        try:
+            item = inbox.get_nowait()
+        except queue.Empty:
+            break
+        if item is _DONE:
+            inbox.put(item)  # leave it for this or another worker to see
+            break
+        batch.append(item)
+    return batch
+
+
+def run_pipeline(source, stages: list, queue_size: int = 16) -> dict:
+    """Feed items from `source` through `stages` and wait until all are done.
+
+    Stages run concurrently with a bounded queue in front of each one, so a
+    slow stage holds back the stages before it. The source is iterated on
+    the calling thread. Returns per-stage counts and time to first output.
+    """
+    started = time.monotonic()
+    queues = [queue.Queue(queue_size) for _ in stages] + [None]
+    lock = threading.Lock()
+    remaining = [stage.workers for stage in stages]
+
+    def worker(index: int):
+        stage, inbox, outbox = stages[index], queues[index], queues[index + 1]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            items = _take_batch(inbox, item, stage.batch_size) if stage.batch_size > 1 else [item]
+            try:
+                result = stage.func(items if stage.batch_size > 1 else items[0])
+            except Exception as e:
+                logging.exception(f"Pipeline stage '{stage.name}' failed: {e}")
+                with lock:
+                    stage.errors += len(items)
+                continue
+            with lock:
+                stage.processed += len(items)
+                if stage.first_output is None:
+                    stage.first_output = time.monotonic() - started
+            if outbox is not None and result is not None:
+                for output in (result if stage.batch_size > 1 else [result]):
+                    if output is not None:
+                        outbox.put(output)
+
+        # The last worker of a stage to finish tells the next stage to stop
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and outbox is not None:
+            for _ in range(stages[index + 1].workers):
+                outbox.put(_DONE)
+
+    threads = []
+    for index, stage in enumerate(stages):
+        for i in range(stage.workers):
+            thread = threading.Thread(target=in_context(worker), args=(index,), name=f"{stage.name}-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    try:
+        for item in source:
+            queues[0].put(item)
+    finally:
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    return {
+        stage.name: {"processed": stage.processed, "errors": stage.errors, "first_output": stage.first_output}
+        for stage in stages
+    }
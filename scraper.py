@@ -0,0 +1,309 @@
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from playwright.sync_api import TimeoutError
+from metrics import timed, count
+
+EVENT_CARD_SELECTOR = 'li > div[class*="SearchResultPanelContentEventCardList"]'
+LOAD_MORE_SELECTOR = 'button[data-testid="load-more-events-button"]'
+SEARCH_HEADER_SELECTOR = 'header[class="search-header"]'
+
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+HTTP_TIMEOUT = 15
+
+MAX_SCROLL_ATTEMPTS = 5
+# How long a scroll may take to render more cards or the load-more button
+SCROLL_SETTLE_MS = 2000
+# Upper bound for a single load-more round trip
+LOAD_MORE_TIMEOUT_MS = 10000
+# How long the load-more button may stay gone, with no new cards, before the list counts as complete
+LOAD_MORE_SETTLE_MS = 3000
+
+# Resolves once a scroll has rendered more cards or the load-more button
+_SCROLL_SETTLED_JS = """
+([cardSelector, buttonSelector, before]) => {
+    if (document.querySelectorAll(cardSelector).length > before) return true;
+    const button = document.querySelector(buttonSelector);
+    return !!button && button.offsetParent !== null;
+}
+"""
+
+# After a load-more click, resolves to "more" once more cards are rendered, "ready" once
+# the button is back and enabled after being hidden or disabled, or "end" once the button
+# has been gone for settleMs with no new cards. The button is often swapped for a spinner
+# while the next page loads, so its disappearing alone doesn't mean the list is complete.
+_MORE_LOADED_JS = """
+([cardSelector, buttonSelector, before, settleMs]) => {
+    if (document.querySelectorAll(cardSelector).length > before) return "more";
+    let state = window.__loadMoreState;
+    if (!state || state.before !== before) {
+        state = window.__loadMoreState = {before: before, hidden: false, goneSince: null};
+    }
+    const button = document.querySelector(buttonSelector);
+    const visible = !!button && button.offsetParent !== null;
+    if (visible && !button.disabled) {
+        state.goneSince = null;
+        return state.hidden ? "ready" : false;
+    }
+    state.hidden = true;
+    if (visible) {
+        state.goneSince = null;
+        return false;
+    }
+    if (state.goneSince === null) state.goneSince = Date.now();
+    return Date.now() - state.goneSince >= settleMs ? "end" : false;
+}
+"""
+
+# Reads every card's link attributes in a single round trip
+_EXTRACT_CARDS_JS = """
+(cards, skip) => cards.slice(skip).map(card => {
+    const link = card.querySelector('[target="_blank"]');
+    if (!link) return null;
+    return {
+        title: link.getAttribute('aria-label'),
+        url: link.getAttribute('href'),
+        event_id: link.getAttribute('data-event-id'),
+    };
+})
+"""
+
+_SERVER_DATA_RE = re.compile(r"window\.__SERVER_DATA__\s*=\s*(\{.*?\});?\s*</script>", re.S)
+_JSON_LD_RE = re.compile(r'<script[^>]+type="application/ld\+json"[^>]*>(.*?)</script>', re.S)
+_EVENT_ID_IN_URL_RE = re.compile(r"-(\d{6,})/?(?:[?#]|$)")
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Which path served each query: "http", "browser" or "failed"
+_path_counts = {"http": 0, "browser": 0, "failed": 0}
+_path_lock = threading.Lock()
+
+
+def _remaining_ms(deadline: float) -> int:
+    return int((deadline - time.monotonic()) * 1000)
+
+
+def count_cards(page) -> int:
+    return page.locator(EVENT_CARD_SELECTOR).count()
+
+
+@timed("browser_open", is_error=lambda loaded: not loaded)
+def open_search_page(page, search_url: str) -> bool:
+    try:
+        logging.info(f"Navigating to: {search_url}")
+        page.goto(search_url, wait_until="domcontentloaded", timeout=90000)
+        page.wait_for_selector(SEARCH_HEADER_SELECTOR, timeout=60000)
+        logging.info("Event list container loaded.")
+        return True
+    except TimeoutError:
+        logging.warning(f"Timeout loading {search_url}")
+        return False
+
+
+def paginate(page, deadline: float):
+    """Scroll and click load-more until no new cards appear or the deadline passes.
+
+    Yields after every step that rendered more cards.
+    """
+    for i in range(MAX_SCROLL_ATTEMPTS):
+        if _remaining_ms(deadline) <= 0:
+            logging.warning("Pagination deadline reached")
+            break
+        try:
+            logging.info(f"Scrolling attempt {i + 1}")
+            before = count_cards(page)
+            page.keyboard.press("End")
+
+            show_more = page.locator(LOAD_MORE_SELECTOR).first
+            if not show_more.is_visible():
+                page.wait_for_function(
+                    _SCROLL_SETTLED_JS,
+                    arg=[EVENT_CARD_SELECTOR, LOAD_MORE_SELECTOR, before],
+                    timeout=max(1, min(SCROLL_SETTLE_MS, _remaining_ms(deadline))),
+                )
+                if not show_more.is_visible():
+                    yield  # infinite scroll added cards, scroll again
+                    continue
+            show_more.click()
+            loaded = page.wait_for_function(
+                _MORE_LOADED_JS,
+                arg=[EVENT_CARD_SELECTOR, LOAD_MORE_SELECTOR, before, LOAD_MORE_SETTLE_MS],
+                timeout=max(1, min(LOAD_MORE_TIMEOUT_MS, _remaining_ms(deadline))),
+            ).json_value()
+            if loaded == "end":
+                break
+            if count_cards(page) > before:
+                yield
+            # "ready" without new cards: the button is back, click it again
+        except TimeoutError:
+            # Nothing new arrived in time: everything is loaded
+            break
+        except Exception as e:
+            logging.warning(f"Scroll error: {e}")
+            break
+
+
+def extract_events(page, skip: int = 0) -> list:
+    # Cards are only ever appended, so `skip` leaves out those already read
+    cards = page.eval_on_selector_all(EVENT_CARD_SELECTOR, _EXTRACT_CARDS_JS, skip)
+    events = []
+    for card in cards:
+        if not card:
+            events.append({'title': 'N/A', 'url': 'N/A', 'event_id': 'N/A'})
+            continue
+        title = card['title']
+        if title and title.startswith("View"):
+            title = title[4:].strip()
+        events.append({'title': title, 'url': card['url'], 'event_id': card['event_id']})
+        print(f'✅ {title} ({card["event_id"]})')
+    return events
+
+
+def iter_events(page, search_url: str, deadline_seconds: float):
+    """Yield events as their cards appear, while pagination continues."""
+    if not open_search_page(page, search_url):
+        return
+    deadline = time.monotonic() + deadline_seconds
+    seen = 0
+    for _ in itertools.chain([None], paginate(page, deadline)):
+        events = extract_events(page, skip=seen)
+        seen += len(events)
+        yield from events
+    print(f"Total visible events: {seen}")
+
+
+# ---------------- HTTP FAST PATH ----------------
+def _event_from_search_result(result: dict):
+    event_id = result.get("eventbrite_event_id") or result.get("eid") or result.get("id")
+    url = result.get("url")
+    if not event_id or not url:
+        return None
+    return {'title': result.get("name"), 'url': url, 'event_id': str(event_id)}
+
+
+def parse_server_data(html: str):
+    match = _SERVER_DATA_RE.search(html)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(1))
+        results = data["search_data"]["events"]["results"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    events = [_event_from_search_result(result) for result in results]
+    return [event for event in events if event]
+
+
+def parse_json_ld(html: str):
+    # None unless there is an item list; also None if it has items but no event IDs were
+    # recognised (e.g. a new URL format), so the browser path gets a chance
+    events = []
+    found = False
+    items = 0
+    for block in _JSON_LD_RE.findall(html):
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+        for entry in data if isinstance(data, list) else [data]:
+            if not isinstance(entry, dict) or "itemListElement" not in entry:
+                continue
+            found = True
+            items += len(entry["itemListElement"])
+            for element in entry["itemListElement"]:
+                item = element.get("item", element) if isinstance(element, dict) else {}
+                url = item.get("url") or ""
+                match = _EVENT_ID_IN_URL_RE.search(url)
+                if match:
+                    events.append({'title': item.get("name"), 'url': url, 'event_id': match.group(1)})
+    if not found or (items and not events):
+        return None
+    return events
+
+
+def _page_url(search_url: str, page: int) -> str:
+    parts = urlsplit(search_url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name != "page"]
+    return urlunsplit(parts._replace(query=urlencode(query + [("page", page)])))
+
+
+def _fetch_search_page(search_url: str):
+    try:
+        res = _session.get(search_url, headers=HTTP_HEADERS, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        logging.warning(f"HTTP search fetch failed: {e}")
+        return None
+    if not res.ok:
+        logging.warning(f"HTTP search fetch returned {res.status_code}")
+        return None
+    events = parse_server_data(res.text)
+    if events is None:
+        events = parse_json_ld(res.text)
+    return events
+
+
+@timed("search_http", is_error=lambda events: events is None)
+def fetch_events_http(search_url: str, max_pages: int = MAX_SCROLL_ATTEMPTS + 1):
+    """Read search results without a browser. Returns None if the page can't be parsed.
+
+    Follows ?page=N for up to max_pages pages, about what the browser path's
+    load-more rounds cover, and stops at the first page with nothing new.
+    """
+    events = _fetch_search_page(search_url)
+    if not events:
+        return events
+    seen = {event['event_id'] for event in events}
+    for page in range(2, max_pages + 1):
+        more = [event for event in _fetch_search_page(_page_url(search_url, page)) or []
+                if event['event_id'] not in seen]
+        if not more:
+            break
+        seen.update(event['event_id'] for event in more)
+        events.extend(more)
+    return events
+
+
+def _record_path(source: str):
+    count("scrape_path_total", path=source)
+    with _path_lock:
+        _path_counts[source] += 1
+        total = sum(_path_counts.values())
+        hit_rate = _path_counts["http"] / total
+    logging.info(f"Search served by {source} path (HTTP hit rate {hit_rate:.0%} over {total} queries)")
+
+
+def stream_events(search_url: str, browser_pool, deadline_seconds: float, mode: str = "auto", report: dict = None):
+    """Yield events as soon as they are found, using the HTTP fast path with a Playwright fallback.
+
+    The path that served the query is stored in report["source"].
+    """
+    report = report if report is not None else {}
+    if mode in ("auto", "http"):
+        events = fetch_events_http(search_url)
+        if events is not None:
+            print(f"Total events from HTTP fast path: {len(events)}")
+            _record_path("http")
+            report["source"] = "http"
+            yield from events
+            return
+        if mode == "http":
+            _record_path("failed")
+            report["source"] = "failed"
+            return
+        logging.info("HTTP fast path could not parse results, falling back to browser")
+
+    _record_path("browser")
+    report["source"] = "browser"
+    with browser_pool.page() as page:
+        yield from iter_events(page, search_url, deadline_seconds)
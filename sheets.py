@@ -0,0 +1,180 @@
+import atexit
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import gspread
+from gspread.exceptions import APIError
+from oauth2client.service_account import ServiceAccountCredentials
+from metrics import stage_timer
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+RETRYABLE_STATUS = {429, 500, 502, 503}
+
+
+def with_backoff(func, *args, max_retries: int = 5, base_delay: float = 1.0, **kwargs):
+    """Call a gspread method, retrying quota and server errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except APIError as e:
+            status = getattr(e.response, "status_code", None)
+            if status not in RETRYABLE_STATUS or attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            logging.warning(f"Sheets API {status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class SheetWriter:
+    """Buffers rows for one worksheet and writes them in batches.
+
+    Rows are flushed with a single append_rows call once batch_size rows are
+    waiting or flush_interval seconds have passed. Dict rows are mapped onto
+    the sheet's header row, which is read once and cached.
+    """
+
+    def __init__(self, worksheet, batch_size: int = 20, flush_interval: float = 5.0,
+                 max_retries: int = 5):
+        self.worksheet = worksheet
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._headers = None
+        self._buffer = []
+        self._inflight = []
+        self._flush_listeners = []
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, daemon=True,
+                                        name=f"sheet-writer-{worksheet.title}")
+        self._thread.start()
+
+    def headers(self, default=None) -> list:
+        with self._lock:
+            if self._headers is None:
+                self._headers = with_backoff(self.worksheet.row_values, 1,
+                                             max_retries=self.max_retries)
+            if not self._headers and default:
+                # Empty sheet: the first rows written carry the header
+                self._headers = list(default)
+                self._buffer.insert(0, self._headers)
+            return self._headers
+
+    def append(self, row):
+        if isinstance(row, dict):
+            headers = self.headers(default=row.keys())
+            row = [row.get(header, "") for header in headers]
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def add_flush_listener(self, listener):
+        # listener(rows) is called after rows have been written successfully
+        self._flush_listeners.append(listener)
+
+    def pending(self) -> list:
+        # Rows not yet confirmed by the Sheets API, including a flush in progress
+        with self._lock:
+            return self._inflight + self._buffer
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return
+                rows, self._buffer = self._buffer, []
+                self._inflight = rows
+            try:
+                with stage_timer("sheets_flush"):
+                    with_backoff(self.worksheet.append_rows, rows,
+                                 value_input_option="RAW", max_retries=self.max_retries)
+                print(f"✅ {len(rows)} rows inserted into Google Sheet.")
+                for listener in self._flush_listeners:
+                    try:
+                        listener(rows)
+                    except Exception as e:
+                        logging.error(f"Flush listener failed: {e}")
+            except Exception as e:
+                logging.error(f"Failed to flush {len(rows)} rows to {self.worksheet.title}: {e}")
+                # Keep them for the next flush
+                with self._lock:
+                    self._buffer = rows + self._buffer
+            finally:
+                with self._lock:
+                    self._inflight = []
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+# ---------------- SHARED CLIENT REGISTRY ----------------
+# One authorized client per service account for the whole process. gspread
+# keeps a single AuthorizedSession per client, which reuses its connections
+# and only fetches a new access token once the current one is about to expire.
+_registry_lock = threading.RLock()
+_credentials = {}
+_clients = {}
+_worksheets = {}
+_writers = {}
+
+
+def load_credentials(env_var: str = "GOOGLE_CREDENTIALS"):
+    """Decode the base64 service account JSON from the environment, once."""
+    with _registry_lock:
+        if env_var not in _credentials:
+            creds_b64 = os.getenv(env_var)
+            if creds_b64 is None:
+                return None
+            creds_b64 = creds_b64.strip()
+            # Fix padding
+            missing_padding = len(creds_b64) % 4
+            if missing_padding:
+                creds_b64 += '=' * (4 - missing_padding)
+            _credentials[env_var] = json.loads(base64.b64decode(creds_b64).decode("utf-8"))
+        return _credentials[env_var]
+
+
+def get_client(creds_dict: dict) -> gspread.Client:
+    key = creds_dict.get("client_email")
+    with _registry_lock:
+        if key not in _clients:
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+            _clients[key] = gspread.authorize(creds)
+        return _clients[key]
+
+
+def register_client(creds_dict: dict, client):
+    # Use an existing client for this service account, e.g. an in-memory stand-in
+    with _registry_lock:
+        _clients[creds_dict.get("client_email")] = client
+
+
+def get_worksheet(sheet_name: str, creds_dict: dict):
+    key = (creds_dict.get("client_email"), sheet_name)
+    with _registry_lock:
+        if key not in _worksheets:
+            _worksheets[key] = get_client(creds_dict).open(sheet_name).sheet1  # First sheet
+        return _worksheets[key]
+
+
+def get_sheet_writer(sheet_name: str, creds_dict: dict) -> SheetWriter:
+    key = (creds_dict.get("client_email"), sheet_name)
+    with _registry_lock:
+        if key not in _writers:
+            _writers[key] = SheetWriter(get_worksheet(sheet_name, creds_dict))
+            atexit.register(_writers[key].close)
+        return _writers[key]
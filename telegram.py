@@ -1,33 +1,212 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
 import requests
+from requests.adapters import HTTPAdapter
+from ratelimit import TokenBucket
+from metrics import timed, count
+
+TELEGRAM_API = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+MAX_MESSAGE_LENGTH = 4096
+GLOBAL_RATE = 30     # messages per second across all chats
+PER_CHAT_RATE = 1    # messages per second to a single chat
+
+# Keep-alive connections shared by every Telegram call
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
 
 def get_latest_offset(bot_token):
-    updates = get_updates(bot_token=bot_token)
+    updates = get_updates(bot_token=bot_token, timeout=0)
     if "result" in updates and updates["result"]:
         last_update_id = updates["result"][-1]["update_id"]
         return last_update_id + 1
     return None
 
-def get_updates(offset=None,bot_token=None):
-    url = f'https://api.telegram.org/bot{bot_token}/getUpdates'
-    params = {'timeout': 100, 'offset': offset}
-    response = requests.get(url, params=params)
+def get_updates(offset=None,bot_token=None,timeout=100):
+    url = f'{TELEGRAM_API}/bot{bot_token}/getUpdates'
+    params = {'timeout': timeout, 'offset': offset}
+    # The HTTP timeout has to outlast the long poll
+    response = _session.get(url, params=params, timeout=timeout + 15)
+    return response.json()
+
+def set_webhook(bot_token: str, url: str, secret_token: str = None, max_connections: int = 40):
+    payload = {"url": url, "max_connections": max_connections}
+    if secret_token:
+        payload["secret_token"] = secret_token
+    response = _session.post(f"{TELEGRAM_API}/bot{bot_token}/setWebhook", json=payload, timeout=30)
     return response.json()
 
+def delete_webhook(bot_token: str):
+    response = _session.post(f"{TELEGRAM_API}/bot{bot_token}/deleteWebhook", timeout=30)
+    return response.json()
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list:
+    """Split text into chunks of at most `limit` characters, preferring line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class TelegramSender:
+    """Sends messages from a small pool of threads over one HTTP session.
+
+    Sends are rate limited globally and per chat with token buckets, and a
+    429's retry_after pauses that chat. Messages to a chat are delivered in
+    order. Messages queued with coalesce=True that pile up for a chat
+    (e.g. while it is rate limited) are joined into as few messages as fit
+    in Telegram's 4096 character limit.
+    """
+
+    def __init__(self, bot_token: str, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 workers: int = 4, max_retries: int = 3):
+        self.url = f"{TELEGRAM_API}/bot{bot_token}/sendMessage"
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._queues = {}        # chat_id -> deque of (text, parse_mode, coalesce)
+        self._ready_at = {}      # chat_id -> monotonic time it may send again
+        self._busy = set()       # chats a worker is currently sending to
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"telegram-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def send(self, chat_id, text: str, parse_mode: str = None, coalesce: bool = False):
+        with self._cond:
+            queue = self._queues.setdefault(chat_id, deque())
+            for chunk in split_message(str(text)):
+                queue.append((chunk, parse_mode, coalesce))
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until everything queued so far has been sent."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while any(self._queues.values()) or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        if chat_id not in self._chat_buckets:
+            self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=3)
+        return self._chat_buckets[chat_id]
+
+    def _next_batch(self, queue: deque):
+        # Pop the next message, merged with queued messages it can be coalesced with
+        text, parse_mode, coalesce = queue.popleft()
+        while coalesce and queue:
+            next_text, next_mode, next_coalesce = queue[0]
+            if not next_coalesce or next_mode != parse_mode:
+                break
+            if len(text) + 2 + len(next_text) > MAX_MESSAGE_LENGTH:
+                break
+            text = f"{text}\n\n{next_text}"
+            queue.popleft()
+        return text, parse_mode, coalesce
+
+    def _claim(self):
+        # Pick a chat that has messages, isn't being sent to and isn't rate limited
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                soonest = None
+                for chat_id, queue in self._queues.items():
+                    if not queue or chat_id in self._busy:
+                        continue
+                    ready_at = self._ready_at.get(chat_id, 0)
+                    if ready_at <= now:
+                        wait = self._chat_bucket(chat_id).try_acquire()
+                        if not wait:
+                            self._busy.add(chat_id)
+                            return chat_id, self._next_batch(queue)
+                        ready_at = self._ready_at[chat_id] = now + wait
+                    soonest = ready_at if soonest is None else min(soonest, ready_at)
+                self._cond.wait(None if soonest is None else soonest - now)
+
+    def _worker(self):
+        while True:
+            chat_id, message = self._claim()
+            retry_after = 0
+            try:
+                self._global.acquire()
+                retry_after = self._post(chat_id, *message)
+            except Exception as e:
+                logging.error(f"Telegram send to {chat_id} failed: {e}")
+            with self._cond:
+                self._busy.discard(chat_id)
+                if retry_after:
+                    # Put it back at the front and hold the chat until Telegram allows it
+                    self._queues[chat_id].appendleft(message)
+                    self._ready_at[chat_id] = time.monotonic() + retry_after
+                elif not self._queues[chat_id]:
+                    del self._queues[chat_id]
+                    self._ready_at.pop(chat_id, None)
+                self._cond.notify_all()
+
+    @timed("telegram_send", is_error=lambda retry_after: retry_after > 0)
+    def _post(self, chat_id, text: str, parse_mode: str, coalesce: bool) -> float:
+        """Send one message. Returns the retry_after seconds on a 429, else 0."""
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = _session.post(self.url, json=payload, timeout=30)
+                count("telegram_requests_total", status=response.status_code)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Telegram request failed ({e}), retrying")
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code == 429:
+                try:
+                    retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    retry_after = 1
+                print(f"⚠️ Telegram rate limit for {chat_id}, retrying in {retry_after}s")
+                return float(retry_after)
+            if response.status_code != 200:
+                print(f"⚠️ Telegram error: {response.text}")
+            else:
+                print("📬 Sent to Telegram.")
+            return 0
+        return 0
+
+
+# One sender per bot token, shared by every caller
+_senders = {}
+_senders_lock = threading.Lock()
+
+def get_sender(bot_token: str) -> TelegramSender:
+    with _senders_lock:
+        if bot_token not in _senders:
+            _senders[bot_token] = TelegramSender(bot_token)
+            atexit.register(_senders[bot_token].flush, 30)
+        return _senders[bot_token]
+
+@timed("telegram_enqueue")
 def send_message(chat_id, text,bot_token):
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-    payload = {"chat_id": chat_id, "text": text}
-    requests.post(url, json=payload)
-
-def send_to_telegram(bot_token: str, chat_id: str, message: str):
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "HTML"
-    }
-    response = requests.post(url, data=payload)
-    if response.status_code != 200:
-        print(f"⚠️ Telegram error: {response.text}")
-    else:
-        print("📬 Sent to Telegram.")
+    get_sender(bot_token).send(chat_id, text)
 
+@timed("telegram_enqueue")
+def send_to_telegram(bot_token: str, chat_id: str, message: str, coalesce: bool = False):
+    get_sender(bot_token).send(chat_id, message, parse_mode="HTML", coalesce=coalesce)
@@ -0,0 +1,94 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1024 * 1024
+
+# Try it locally with a recorded update:
+#   curl -X POST localhost:8443/telegram -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+#        -H "Content-Type: application/json" -d @update.json
+
+
+class WebhookServer:
+    """HTTP endpoint that receives Telegram updates and passes them to submit().
+
+    Telegram considers an update delivered once we answer 200, so the
+    response is sent after submit() has queued it. A full queue therefore
+    slows Telegram down instead of dropping updates.
+    """
+
+    def __init__(self, submit, host: str = "0.0.0.0", port: int = 8443, path: str = "/telegram",
+                 secret_token: str = None):
+        self.submit = submit
+        self.path = path
+        self.secret_token = secret_token
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def serve_forever(self):
+        logging.info(f"Webhook listening on port {self.port}{self.path}")
+        self.httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._reply(200, "ok")
+                else:
+                    self._reply(404, "not found")
+
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404, "not found")
+                if server.secret_token and not hmac.compare_digest(
+                        self.headers.get(SECRET_HEADER, ""), server.secret_token):
+                    return self._reply(401, "bad secret token")
+
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    return self._reply(400, "bad content length")
+                try:
+                    update = json.loads(self.rfile.read(length))
+                    update["update_id"]
+                except (ValueError, KeyError, TypeError):
+                    return self._reply(400, "invalid update")
+
+                try:
+                    queued = server.submit(update)
+                except Exception as e:
+                    # Not queued: a non-200 makes Telegram deliver it again later
+                    logging.warning(f"Webhook update {update['update_id']} not queued: {e}")
+                    return self._reply(503, "not accepted")
+                # A duplicate is already queued or handled, so it is acknowledged too
+                self._reply(200, "ok" if queued else "duplicate")
+
+            def _reply(self, status: int, body: str):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook {self.address_string()} {format % args}")
+
+        return Handler